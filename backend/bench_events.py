@@ -0,0 +1,132 @@
+"""
+Event latency benchmark for the Socket.IO backend.
+
+Connects many clients to a running server. Each one subscribes to the
+device's patient and then repeatedly sends `set_max_seconds` with a value
+no other client uses. It times the round trip until its own
+`max_seconds_update` comes back through the room broadcast. Every client
+receives every other client's updates too, so the fan-out grows with the
+square of the number of clients. With --train the same measurements are
+taken while the server trains a model, which shows whether CPU-bound work
+holds up the event loop.
+
+Needs a running backend (python main.py). It changes the max activity
+seconds, so don't point it at a server that is monitoring a patient.
+
+Usage:
+    python bench_events.py --clients 10 50 100 --rounds 20
+    python bench_events.py --clients 10 --train test
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+import socketio
+
+# --- Configuration ---
+CONNECT_TIMEOUT = 10   # Seconds to wait for each client to connect and receive its snapshot
+REPLY_TIMEOUT = 10     # Seconds to wait for a single round trip before counting it as lost
+BASE_VALUE = 100000    # Benchmark maxSeconds values start here, well away from real settings
+TRAINING_TIMEOUT = 60  # Seconds to wait for a training run to reach its first epoch
+
+async def run_client(url, client_id, rounds, ready, start, latencies, lost):
+    # One benchmark client: connects, subscribes, then times `rounds` round trips.
+    sio = socketio.AsyncClient(reconnection=False)
+    pending = {}
+    subscribed = asyncio.Event()
+
+    @sio.on('max_seconds_update')
+    async def on_max_seconds(data):
+        future = pending.pop(data.get('maxSeconds'), None)
+        if future and not future.done():
+            future.set_result(time.perf_counter())
+
+    @sio.on('state_update')
+    async def on_state(data):
+        subscribed.set()
+
+    try:
+        await sio.connect(url, transports=['websocket'], wait_timeout=CONNECT_TIMEOUT)
+        await sio.emit('subscribe', {})
+        await asyncio.wait_for(subscribed.wait(), CONNECT_TIMEOUT)
+    finally:
+        ready.release()
+
+    await start.wait()  # All clients start sending together
+    loop = asyncio.get_running_loop()
+    for r in range(rounds):
+        value = BASE_VALUE + client_id * rounds + r
+        pending[value] = loop.create_future()
+        sent = time.perf_counter()
+        await sio.emit('set_max_seconds', {'maxSeconds': value})
+        try:
+            received = await asyncio.wait_for(pending[value], REPLY_TIMEOUT)
+            latencies.append(1000 * (received - sent))
+        except asyncio.TimeoutError:
+            pending.pop(value, None)
+            lost.append(value)
+    await sio.disconnect()
+
+async def benchmark(url, num_clients, rounds):
+    # Runs one benchmark level and returns its summary.
+    ready = asyncio.Semaphore(0)
+    start = asyncio.Event()
+    latencies, lost = [], []
+    tasks = [asyncio.create_task(run_client(url, i, rounds, ready, start, latencies, lost))
+             for i in range(num_clients)]
+    for _ in range(num_clients):
+        await ready.acquire()
+
+    began = time.perf_counter()
+    start.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - began
+
+    summary = {'clients': num_clients, 'events': len(latencies), 'lost': len(lost),
+               'events_per_s': len(latencies) / elapsed if elapsed > 0 else 0.0}
+    if latencies:
+        for p in (50, 90, 99):
+            summary[f'p{p}'] = float(np.percentile(latencies, p))
+        summary['max'] = max(latencies)
+    return summary
+
+async def start_training(url, patient_id):
+    # Asks the server to train a model from scratch and returns once the first epoch is done,
+    # so the measurements fall inside the training loop rather than the data loading.
+    sio = socketio.AsyncClient(reconnection=False)
+    epochs_started = asyncio.Event()
+
+    @sio.on('training_status')
+    async def on_training_status(data):
+        if data.get('message', '').startswith("Epoch"):
+            epochs_started.set()
+
+    await sio.connect(url, transports=['websocket'], wait_timeout=CONNECT_TIMEOUT)
+    await sio.emit('train_model', {'patient_id': patient_id, 'mode': 'scratch'})
+    await asyncio.wait_for(epochs_started.wait(), TRAINING_TIMEOUT)
+    return sio
+
+async def main(url, client_counts, rounds, train_patient=None):
+    trainer = await start_training(url, train_patient) if train_patient else None
+    for num_clients in client_counts:
+        s = await benchmark(url, num_clients, rounds)
+        if not s['events']:
+            print(f"{num_clients:>5} clients: no replies ({s['lost']} lost)")
+            continue
+        print(f"{num_clients:>5} clients: p50 {s['p50']:7.2f} ms  p90 {s['p90']:7.2f} ms  p99 {s['p99']:7.2f} ms  "
+              f"max {s['max']:7.2f} ms  {s['events_per_s']:7.1f} events/s  {s['lost']} lost")
+    if trainer:
+        await trainer.disconnect()
+
+# --- Command Line Entry Point ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure set_max_seconds round-trip latency with many clients.")
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 50, 100], help="Client counts to test")
+    parser.add_argument('--rounds', type=int, default=20, help="Round trips per client")
+    parser.add_argument('--train', default=None, metavar='PATIENT',
+                        help="Measure while the server trains this patient's model (overwrites it)")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.url, args.clients, args.rounds, args.train))
@@ -0,0 +1,123 @@
+"""
+Simulated wearable for running the backend without hardware.
+
+Speaks the firmware's serial protocol over a local TCP socket. pyserial,
+and so the backend, opens it like a serial port through a socket:// URL.
+It replays recorded packets at the firmware's sample rate and answers LCD
+and backlight commands with "ACK:<type>" as the firmware does. Every packet
+carries a sequence field (SEQUENCE_KEY), and the time each one was sent is
+kept. Tools running the device in-process can then measure latency from a
+sample leaving the device to a dashboard receiving the update it caused.
+
+Usage:
+    python fake_device.py --port 7000
+    SERIAL_PORT=socket://127.0.0.1:7000 python main.py
+"""
+import argparse
+import asyncio
+import time
+
+from shared_config import SAMPLE_RATE_HZ, SEQUENCE_KEY
+
+# --- Configuration ---
+DEFAULT_RECORDINGS = ['test_still.csv', 'test_active.csv']
+FALLBACK_PACKET = "T:24.0,X:2048,Y:2048,Z:2048,L:0,S:0"  # Used when no recording could be read
+
+def load_packets(paths):
+    # Returns the data packets (lines starting with "T:") of the recordings, in order.
+    packets = []
+    for path in paths:
+        try:
+            with open(path) as f:
+                packets.extend(line.strip() for line in f if line.startswith("T:"))
+        except OSError as e:
+            print(f"Skipping recording {path}: {e}")
+    return packets or [FALLBACK_PACKET]
+
+class FakeDevice:
+    def __init__(self, packets, rate_hz=SAMPLE_RATE_HZ):
+        self.packets = packets
+        self.rate_hz = rate_hz
+        self.sequence = 0
+        self.sent_at = {}      # {sequence number: time.time() when the packet was written}
+        self.commands = {}     # {command type: count}
+        self.connections = 0
+        self.connected = None  # Set once the backend has completed a handshake
+        self.server = None
+        self.sessions = {}     # {handler task: writer} of the open connections
+
+    async def start(self, host='127.0.0.1', port=0):
+        # Starts listening and returns the serial URL to give the backend.
+        self.connected = asyncio.Event()
+        self.server = await asyncio.start_server(self._handle, host, port)
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"socket://{host}:{port}"
+
+    async def stop(self):
+        # Closes the open connections too and lets their handlers finish.
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        for writer in self.sessions.values():
+            writer.close()
+        await asyncio.gather(*self.sessions, return_exceptions=True)
+
+    async def _handle(self, reader, writer):
+        # One backend connection: stream packets while answering its commands.
+        self.connections += 1
+        session = asyncio.current_task()
+        self.sessions[session] = writer
+        stream = asyncio.create_task(self._stream(writer))
+        try:
+            while line := await reader.readline():
+                command = line.decode('ascii', errors='ignore').strip()
+                command_type = command.split(':', 1)[0]
+                if ':' not in command:
+                    reply = "ERR:Invalid format"
+                elif command_type in ('L', 'RGB'):
+                    reply = f"ACK:{command_type}"
+                    self.commands[command_type] = self.commands.get(command_type, 0) + 1
+                    self.connected.set()
+                else:
+                    reply = "ERR:Unknown command"
+                writer.write(f"{reply}\n".encode('ascii'))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            stream.cancel()
+            writer.close()
+            self.sessions.pop(session, None)
+
+    async def _stream(self, writer):
+        # Sends packets on a fixed schedule, so a slow reader does not change the sample rate.
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        sent = 0
+        while True:
+            await asyncio.sleep(max(0.0, start + sent / self.rate_hz - loop.time()))
+            packet = self.packets[self.sequence % len(self.packets)]
+            self.sent_at[self.sequence] = time.time()
+            writer.write(f"{packet},{SEQUENCE_KEY}:{self.sequence}\n".encode('ascii'))
+            self.sequence += 1
+            sent += 1
+
+async def main(host, port, recordings, rate_hz):
+    device = FakeDevice(load_packets(recordings), rate_hz)
+    url = await device.start(host, port)
+    print(f"Simulated device listening at {url} ({rate_hz} Hz, {len(device.packets)} packets)")
+    print(f"Start the backend with: SERIAL_PORT={url} python main.py")
+    await device.server.serve_forever()
+
+# --- Command Line Entry Point ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated wearable that speaks the firmware protocol over TCP.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7000)
+    parser.add_argument('--recordings', nargs='+', default=DEFAULT_RECORDINGS, help="Recordings to replay in a loop")
+    parser.add_argument('--rate', type=float, default=SAMPLE_RATE_HZ, help="Packets per second")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(main(args.host, args.port, args.recordings, args.rate))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,152 @@
+"""
+Feature extraction shared by training, offline scoring and live inference.
+
+Features are computed per sample over the continuous accelerometer stream
+and then cut into windows, so a window sees the same values however it was
+produced. Each extractor has two forms that give the same results:
+  - batch():  vectorized over a whole recording, used for training and scoring.
+  - step():   incremental, one sample at a time with O(1) work, used live.
+
+The list of extractors a model was trained with is stored in its checkpoint,
+so the live loop always builds the matching channels.
+"""
+from collections import deque
+
+import numpy as np
+
+# --- Configuration ---
+DEFAULT_FEATURES = ['raw', 'delta']  # X, Y, Z, deltaX, deltaY, deltaZ (6 channels)
+ROLLING_SIZE = 10  # Samples in the rolling statistics (1 s at 10 Hz)
+
+# --- Extractors ---
+class RawExtractor:
+    # The accelerometer values themselves: X, Y, Z.
+    channels = 3
+
+    def batch(self, raw):
+        return raw
+
+    def step(self, sample):
+        return sample
+
+class DeltaExtractor:
+    # Jerk: the change in acceleration since the previous sample.
+    channels = 3
+
+    def __init__(self):
+        self.previous = None
+
+    def batch(self, raw):
+        deltas = np.zeros_like(raw)
+        deltas[1:] = np.diff(raw, axis=0)
+        # Assume the first sample has the same jerk as the second.
+        if len(raw) > 1:
+            deltas[0] = deltas[1]
+        return deltas
+
+    def step(self, sample):
+        delta = np.zeros_like(sample) if self.previous is None else sample - self.previous
+        self.previous = sample
+        return delta
+
+class MagnitudeExtractor:
+    # Orientation-independent acceleration magnitude.
+    channels = 1
+
+    def batch(self, raw):
+        return np.linalg.norm(raw, axis=1, keepdims=True)
+
+    def step(self, sample):
+        return np.array([np.linalg.norm(sample)])
+
+class _RollingMean:
+    # Mean of a per-sample value over the last ROLLING_SIZE samples (fewer at the start of a stream).
+    def __init__(self, size=ROLLING_SIZE):
+        self.values = deque(maxlen=size)
+        self.total = 0.0
+
+    def push(self, value):
+        if len(self.values) == self.values.maxlen:
+            self.total -= self.values[0]
+        self.values.append(value)
+        self.total += value
+        return self.total / len(self.values)
+
+def _rolling_mean(values, size=ROLLING_SIZE):
+    # Vectorized equivalent of _RollingMean over a whole array.
+    sums = np.cumsum(values, dtype=np.float64)
+    sums[size:] = sums[size:] - sums[:-size]
+    counts = np.minimum(np.arange(1, len(values) + 1), size)
+    return sums / counts
+
+class RollingVarianceExtractor:
+    # Variance of the magnitude over the last ROLLING_SIZE samples: how much the patient is moving.
+    channels = 1
+
+    def __init__(self):
+        self.mean = _RollingMean()
+        self.mean_sq = _RollingMean()
+
+    def batch(self, raw):
+        magnitude = np.linalg.norm(raw.astype(np.float64), axis=1)
+        variance = _rolling_mean(magnitude ** 2) - _rolling_mean(magnitude) ** 2
+        return np.maximum(variance, 0)[:, None]
+
+    def step(self, sample):
+        magnitude = float(np.linalg.norm(sample))
+        variance = self.mean_sq.push(magnitude ** 2) - self.mean.push(magnitude) ** 2
+        return np.array([max(variance, 0.0)])
+
+class SpectralEnergyExtractor:
+    # High-frequency energy of the magnitude: the rolling mean of its squared first difference.
+    # Differencing is a high-pass filter, so this is the signal's spectral energy weighted towards
+    # fast movements, without an FFT.
+    channels = 1
+
+    def __init__(self):
+        self.previous = None
+        self.energy = _RollingMean()
+
+    def batch(self, raw):
+        magnitude = np.linalg.norm(raw.astype(np.float64), axis=1)
+        diff_sq = np.zeros_like(magnitude)
+        diff_sq[1:] = np.diff(magnitude) ** 2
+        return _rolling_mean(diff_sq)[:, None]
+
+    def step(self, sample):
+        magnitude = float(np.linalg.norm(sample))
+        diff_sq = 0.0 if self.previous is None else (magnitude - self.previous) ** 2
+        self.previous = magnitude
+        return np.array([self.energy.push(diff_sq)])
+
+EXTRACTORS = {
+    'raw': RawExtractor,
+    'delta': DeltaExtractor,
+    'magnitude': MagnitudeExtractor,
+    'rolling_var': RollingVarianceExtractor,
+    'spectral_energy': SpectralEnergyExtractor,
+}
+
+# --- Pipeline ---
+def num_channels(feature_names=DEFAULT_FEATURES):
+    return sum(EXTRACTORS[name].channels for name in feature_names)
+
+def extract_features(raw, feature_names=DEFAULT_FEATURES):
+    # Computes the features of a whole recording of raw [X, Y, Z] samples.
+    # Returns: (num_samples, num_channels) float32 array.
+    raw = np.asarray(raw, dtype=np.float32)
+    parts = [EXTRACTORS[name]().batch(raw) for name in feature_names]
+    return np.concatenate(parts, axis=1).astype(np.float32)
+
+class FeatureStream:
+    # Incremental feature extraction for the live stream: push one raw sample, get its feature row.
+    def __init__(self, feature_names=DEFAULT_FEATURES):
+        self.feature_names = list(feature_names)
+        self.reset()
+
+    def reset(self):
+        self.extractors = [EXTRACTORS[name]() for name in self.feature_names]
+
+    def push(self, sample):
+        sample = np.asarray(sample, dtype=np.float32)
+        return np.concatenate([extractor.step(sample) for extractor in self.extractors]).astype(np.float32)
@@ -0,0 +1,204 @@
+"""
+Hyperparameter and window-size search for per-patient models.
+
+Evaluates a grid or random sample of window/step/width/learning-rate settings
+with k-fold cross-validation over contiguous blocks of each recording. Window length and step are in seconds. Trials run in parallel across CPU cores on data
+that is loaded and featurized once. Weak trials are pruned after the first
+fold (successive halving). The most accurate configuration wins, except that
+a cheaper one is preferred when its accuracy is within a tolerance. The chosen
+configuration is then used to train and save the patient's model, so the live
+loop picks up the matching window parameters from the checkpoint.
+
+Usage:
+    python hparam_search.py --patient test --mode random --trials 24
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from sklearn.preprocessing import StandardScaler
+
+from shared_config import NUM_CLASSES
+from features import num_channels
+from train_model import (
+    DEFAULT_TRAINING_CONFIG, HARModel, resolve_config, load_patient_data, create_windows,
+    scale_windows, make_loader, fit_model, evaluate, train_model
+)
+
+# --- Search Configuration ---
+SEARCH_SPACE = {
+    'window_seconds': [1.0, 2.0, 3.0, 4.0],
+    'step_seconds': [0.5, 1.0, 2.0],
+    'width': [16, 32, 64],
+    'lr': [0.0003, 0.001, 0.003],
+}
+SEARCH_EPOCHS = 10        # Epochs per fold during the search (the final model uses DEFAULT_TRAINING_CONFIG)
+NUM_FOLDS = 3
+KEEP_FRACTION = 0.5       # Fraction of trials that survive the first fold
+ACCURACY_TOLERANCE = 1.0  # Percentage points of accuracy we will give up for a cheaper model
+
+# Featurized data shared by the worker processes (set once per worker by _init_worker).
+_FEATURES = None
+_LABELS = None
+
+def _init_worker(features, labels):
+    # Each worker trains single-threaded so parallel trials don't fight over cores.
+    global _FEATURES, _LABELS
+    _FEATURES, _LABELS = features, labels
+    torch.set_num_threads(1)
+
+# --- Trial Generation ---
+def generate_trials(mode="grid", num_trials=None, seed=42):
+    # Returns a list of trial configs from SEARCH_SPACE. Steps larger than the window are skipped.
+    keys = list(SEARCH_SPACE)
+    trials = [dict(zip(keys, values)) for values in itertools.product(*SEARCH_SPACE.values())]
+    trials = [trial for trial in trials if trial['step_seconds'] <= trial['window_seconds']]
+    if mode == "random" and num_trials:
+        trials = random.Random(seed).sample(trials, min(num_trials, len(trials)))
+    return trials
+
+def inference_cost(config):
+    # Approximate multiply-accumulates per second of streamed data.
+    # A window is classified every `step_seconds`, so cheaper models and larger steps both help.
+    config = resolve_config(config)
+    width, window = config['width'], config['window_size']
+    channels = num_channels(DEFAULT_TRAINING_CONFIG['features'])
+    macs = (window * channels * width * 3             # conv1
+            + (window // 2) * width * 2 * width * 3   # conv2 (after the first pooling)
+            + 2 * width * width + width * NUM_CLASSES)  # fc1 + fc2
+    return macs / config['step_seconds']
+
+# --- Trial Evaluation ---
+def blocked_folds(y, num_folds, gap):
+    # Splits time-ordered windows into folds of contiguous blocks, one block per activity in each fold.
+    # Overlapping windows are near-duplicates, so training windows within `gap` windows of a validation
+    # block are left out. Shuffled folds would score the overlap, favouring small steps and long windows.
+    # Returns a list of (train_idx, val_idx) pairs.
+    blocks = [np.array_split(np.flatnonzero(y == label), num_folds) for label in np.unique(y)]
+    folds = []
+    for fold in range(num_folds):
+        val_idx = np.concatenate([label_blocks[fold] for label_blocks in blocks])
+        excluded = np.zeros(len(y), dtype=bool)
+        for label_blocks in blocks:
+            block = label_blocks[fold]
+            if len(block):
+                excluded[max(0, block[0] - gap + 1) : block[-1] + gap] = True
+        folds.append((np.flatnonzero(~excluded), np.sort(val_idx)))
+    return folds
+
+def run_fold(config, fold):
+    # Trains and evaluates one trial config on one cross-validation fold (runs in a worker process).
+    config = resolve_config(config)
+    X, y = create_windows(_FEATURES, _LABELS, config['window_size'], config['step_size'])
+    # Windows less than a window length apart overlap, so that many are kept out around each validation block.
+    gap = -(-config['window_size'] // config['step_size'])
+    train_idx, val_idx = blocked_folds(y, NUM_FOLDS, gap)[fold]
+
+    # Fit the scaler on the training fold only so validation data stays unseen.
+    scaler = StandardScaler().fit(X[train_idx].reshape(-1, X.shape[2]))
+    train_loader = make_loader(scale_windows(scaler, X[train_idx]), y[train_idx], DEFAULT_TRAINING_CONFIG['batch_size'], shuffle=True)
+    val_loader = make_loader(scale_windows(scaler, X[val_idx]), y[val_idx], DEFAULT_TRAINING_CONFIG['batch_size'])
+
+    torch.manual_seed(42)
+    model = HARModel(num_classes=NUM_CLASSES, width=config['width'], in_channels=X.shape[2])
+    fit_model(model, train_loader, val_loader, config['lr'], SEARCH_EPOCHS)
+    # Score the final weights rather than the best epoch, which would leak the validation fold.
+    return evaluate(model, val_loader)
+
+def _run_folds(executor, trials, folds, results):
+    # Runs the given folds of each trial in parallel and appends the accuracies to results[i].
+    futures = {executor.submit(run_fold, trials[i], fold): i for i in results for fold in folds}
+    for future, i in futures.items():
+        results[i].append(future.result())
+
+def measure_latency(config, repeats=200):
+    # Median wall-clock time (ms) of one single-window forward pass on the CPU.
+    config = resolve_config(config)
+    channels = num_channels(DEFAULT_TRAINING_CONFIG['features'])
+    model = HARModel(num_classes=NUM_CLASSES, width=config['width'], in_channels=channels).eval()
+    window = torch.randn(1, channels, config['window_size'])
+    timings = []
+    with torch.no_grad():
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(window)
+            timings.append(time.perf_counter() - start)
+    return 1000 * float(np.median(timings))
+
+def search(patient_id="test", mode="grid", num_trials=None, workers=None, status_callback=print):
+    # Runs the search and returns (best_config, results), or (None, []) if there is no data.
+    features, labels, _ = load_patient_data(patient_id, status_callback, DEFAULT_TRAINING_CONFIG['features'],
+                                            DEFAULT_TRAINING_CONFIG['sample_rate'])
+    if features is None:
+        status_callback(f"Error: No data found for patient '{patient_id}'. Search aborted.")
+        return None, []
+
+    trials = generate_trials(mode, num_trials)
+    workers = workers or os.cpu_count()
+    status_callback(f"Evaluating {len(trials)} trials with {NUM_FOLDS}-fold CV on {workers} workers...")
+
+    start = time.time()
+    # 'spawn' keeps workers independent of the parent's torch thread pool (and matches Windows).
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(features, labels)) as executor:
+        # Rung 1: every trial runs its first fold.
+        fold_scores = {i: [] for i in range(len(trials))}
+        _run_folds(executor, trials, [0], fold_scores)
+
+        # Prune: only the best trials continue to the remaining folds.
+        ranked = sorted(fold_scores, key=lambda i: fold_scores[i][0], reverse=True)
+        survivors = ranked[:max(1, int(len(ranked) * KEEP_FRACTION))]
+        status_callback(f"Pruned {len(trials) - len(survivors)} trials after fold 1")
+        survivor_scores = {i: fold_scores[i] for i in survivors}
+        _run_folds(executor, trials, range(1, NUM_FOLDS), survivor_scores)
+
+    results = []
+    for i, scores in fold_scores.items():
+        results.append({
+            **trials[i],
+            'accuracy': float(np.mean(scores)),
+            'folds': len(scores),
+            'cost': inference_cost(trials[i]),
+            'pruned': i not in survivors,
+        })
+    status_callback(f"Search finished in {time.time() - start:.1f}s")
+
+    # Pick the cheapest surviving trial whose accuracy is within tolerance of the best.
+    finalists = [result for result in results if not result['pruned']]
+    best_acc = max(result['accuracy'] for result in finalists)
+    candidates = [result for result in finalists if result['accuracy'] >= best_acc - ACCURACY_TOLERANCE]
+    best = min(candidates, key=lambda result: (result['cost'], -result['accuracy']))
+    best['latency_ms'] = measure_latency(best)
+
+    best_config = {key: best[key] for key in SEARCH_SPACE}
+    status_callback(f"Best config: {best_config} - CV Acc: {best['accuracy']:.2f}%, "
+                    f"{best['cost']:.0f} MACs/s, {best['latency_ms']:.2f} ms/window")
+    return best_config, results
+
+# --- Command Line Entry Point ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search window and training settings for a patient's model.")
+    parser.add_argument('--patient', default='test', help="Patient ID whose recordings are used")
+    parser.add_argument('--mode', choices=['grid', 'random'], default='grid')
+    parser.add_argument('--trials', type=int, default=24, help="Number of trials in random mode")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--no-train', action='store_true', help="Only report results, don't train the final model")
+    args = parser.parse_args()
+
+    best_config, results = search(args.patient, args.mode, args.trials, args.workers)
+    if best_config:
+        results_filename = f"{args.patient}_search.json"
+        with open(results_filename, 'w') as f:
+            json.dump({'best': best_config, 'trials': results}, f, indent=2)
+        print(f"Search results saved: {results_filename}")
+
+        if not args.no_train:
+            train_model(args.patient, config=best_config)
@@ -0,0 +1,248 @@
+"""
+Headless dashboard load generator for the Socket.IO fan-out.
+
+Runs the backend against a simulated device (fake_device.py), fully
+locally. It opens many dashboard clients and replays a session the way the
+frontend drives it:
+  - Viewers connect over a ramp-up period and subscribe to the device's
+    patient. A small share of them also change the inactivity limit from
+    time to time (set_max_seconds).
+  - An operator client steps the device through phases: set_state active
+    and sleeping, and a recording start/stop.
+Every packet from the simulated device is numbered and the backend echoes
+the number in `activity_update` and `sleep_data_update` (and in the raw
+`live_data` line). The tool reports latency from the device sending a
+sample to each client receiving the update it caused, as percentiles per
+event and per client count.
+
+By default the backend (main.py) is started for the test and stopped
+afterwards. With --url an already running backend is used instead; it
+must have been started with SERIAL_PORT pointing at this tool's device
+(see --device-port).
+
+Usage:
+    python load_test.py --clients 50 100 200 400
+    python load_test.py --clients 200 --phase-seconds 20 --processes 4
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import socketio
+
+from shared_config import SAMPLE_RATE_HZ, SEQUENCE_KEY
+from fake_device import DEFAULT_RECORDINGS, FakeDevice, load_packets
+
+# --- Configuration ---
+SERVER_URL = 'http://127.0.0.1:5000'
+PHASES = ['active', 'sleeping', 'recording', 'active']  # Operator actions, one per phase
+RECORDING_PATIENT = 'loadtest'     # Recordings made by the test go to loadtest_<activity>.csv
+RECORDING_ACTIVITY = 'active'
+INTERACTIVE_FRACTION = 0.05        # Share of viewers that also change the inactivity limit
+INTERACTION_INTERVAL = 5.0         # Mean seconds between an interactive viewer's changes
+MAX_SECONDS_CHOICES = [120, 300, 600]
+STARTUP_TIMEOUT = 60               # Seconds to wait for the backend to come up and find the device
+CONNECT_TIMEOUT = 10
+LATENCY_EVENTS = ['activity_update', 'sleep_data_update', 'live_data']
+
+# --- Clients ---
+def sample_number(event, data):
+    # The device sequence number carried by an update, or None (e.g. for snapshots).
+    if event == 'live_data':
+        for part in data.get('data', '').split(','):
+            if part.startswith(f"{SEQUENCE_KEY}:"):
+                return int(float(part[len(SEQUENCE_KEY) + 1:]))
+        return None
+    return data.get('sample')
+
+def track_receipts(sio, receipts):
+    # Records (event, sample number, receive time) for every update that names its sample.
+    for event in LATENCY_EVENTS:
+        def handler(data, event=event):
+            sample = sample_number(event, data)
+            if sample is not None:
+                receipts.append((event, sample, time.time()))
+        sio.on(event, handler)
+
+async def run_viewer(url, start_at, stop_at, interactive, seed, receipts, failures):
+    # One dashboard: connects at `start_at`, follows the device's patient until `stop_at`.
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    sio = socketio.AsyncClient(reconnection=False)
+    track_receipts(sio, receipts)
+    try:
+        await sio.connect(url, transports=['websocket'], wait_timeout=CONNECT_TIMEOUT)
+        await sio.emit('subscribe', {})
+    except Exception as e:
+        failures.append(str(e))
+        return
+
+    rng = random.Random(seed)
+    while time.time() < stop_at:
+        if interactive:
+            await asyncio.sleep(min(rng.expovariate(1 / INTERACTION_INTERVAL), max(0.0, stop_at - time.time())))
+            if time.time() < stop_at:
+                await sio.emit('set_max_seconds', {'maxSeconds': rng.choice(MAX_SECONDS_CHOICES)})
+        else:
+            await asyncio.sleep(stop_at - time.time())
+    await sio.disconnect()
+
+async def run_viewers(url, client_ids, start_at, ramp, stop_at, interactive_ids):
+    receipts, failures = [], []
+    await asyncio.gather(*(
+        run_viewer(url, start_at + ramp * i / max(1, len(client_ids)), stop_at,
+                   client_id in interactive_ids, client_id, receipts, failures)
+        for i, client_id in enumerate(client_ids)
+    ))
+    return receipts, failures
+
+def viewer_worker(url, client_ids, start_at, ramp, stop_at, interactive_ids):
+    # Runs a share of the viewers in a separate process, so the clients don't slow down the device clock.
+    return asyncio.run(run_viewers(url, client_ids, start_at, ramp, stop_at, interactive_ids))
+
+async def run_operator(url, start_at, phases, phase_seconds, receipts):
+    # The clinician's dashboard: drives the device through the phases. Receives the recording's live data.
+    sio = socketio.AsyncClient(reconnection=False)
+    track_receipts(sio, receipts)
+    await sio.connect(url, transports=['websocket'], wait_timeout=CONNECT_TIMEOUT)
+    await sio.emit('subscribe', {})
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    for phase in phases:
+        if phase == 'recording':
+            await sio.emit('start_recording', {'patient_id': RECORDING_PATIENT, 'activity': RECORDING_ACTIVITY})
+            await asyncio.sleep(phase_seconds)
+            await sio.emit('stop_recording')
+        else:
+            await sio.emit('set_state', {'state': phase})
+            await asyncio.sleep(phase_seconds)
+    await sio.disconnect()
+
+# --- Test Run ---
+async def run_level(url, device, num_clients, processes, phase_seconds, ramp):
+    # Runs the whole session with `num_clients` viewers. Returns the latencies (ms) per event and the failures.
+    loop = asyncio.get_running_loop()
+    start_at = time.time() + 2.0  # Time for the worker processes to start
+    phases_at = start_at + ramp
+    stop_at = phases_at + phase_seconds * len(PHASES)
+
+    client_ids = list(range(num_clients))
+    interactive_ids = set(random.Random(num_clients).sample(client_ids, int(num_clients * INTERACTIVE_FRACTION)))
+    shares = [client_ids[i::processes] for i in range(processes)]
+
+    operator_receipts = []
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        viewers = [loop.run_in_executor(executor, viewer_worker, url, share, start_at, ramp, stop_at, interactive_ids)
+                   for share in shares if share]
+        await run_operator(url, phases_at, PHASES, phase_seconds, operator_receipts)
+        results = await asyncio.gather(*viewers)
+
+    receipts = operator_receipts + [receipt for share_receipts, _ in results for receipt in share_receipts]
+    failures = [failure for _, share_failures in results for failure in share_failures]
+    latencies = {event: [] for event in LATENCY_EVENTS}
+    for event, sample, received in receipts:
+        if sample in device.sent_at:
+            latencies[event].append(1000 * (received - device.sent_at[sample]))
+    return latencies, failures
+
+def summarize(latencies):
+    if not latencies:
+        return None
+    return {
+        'count': len(latencies),
+        'p50': float(np.percentile(latencies, 50)),
+        'p90': float(np.percentile(latencies, 90)),
+        'p99': float(np.percentile(latencies, 99)),
+        'max': float(max(latencies)),
+    }
+
+def start_backend(device_url, rate_hz, log_path):
+    # Starts main.py with the simulated device as its serial port, expecting packets at rate_hz.
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, SERIAL_PORT=device_url, SAMPLE_RATE_HZ=str(rate_hz), PYTHONUNBUFFERED='1')
+    log = open(log_path, 'w') if log_path else subprocess.DEVNULL
+    return subprocess.Popen([sys.executable, 'main.py'], cwd=backend_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+async def wait_for_server(url, device, timeout=STARTUP_TIMEOUT):
+    # Waits until the backend accepts connections and has completed its handshake with the device.
+    host, port = url.split('://', 1)[-1].split(':')
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, int(port)), timeout=1).close()
+            await asyncio.wait_for(device.connected.wait(), max(0.1, deadline - time.time()))
+            return True
+        except (OSError, asyncio.TimeoutError):
+            await asyncio.sleep(0.5)
+    return False
+
+async def main(args):
+    device = FakeDevice(load_packets(args.recordings), args.rate)
+    device_url = await device.start(port=args.device_port)
+    print(f"Simulated device at {device_url} ({args.rate} Hz)")
+
+    recording_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{RECORDING_PATIENT}_{RECORDING_ACTIVITY}.csv")
+    had_recording = os.path.exists(recording_file)
+    backend = None
+    if not args.url:
+        backend = start_backend(device_url, args.rate, args.server_log)
+    url = args.url or SERVER_URL
+
+    results = []
+    try:
+        if not await wait_for_server(url, device):
+            print(f"Backend at {url} did not connect to the simulated device within {STARTUP_TIMEOUT}s")
+            return results
+
+        print(f"Phases: {', '.join(PHASES)} ({args.phase_seconds:g}s each), ramp-up {args.ramp:g}s")
+        for num_clients in args.clients:
+            latencies, failures = await run_level(url, device, num_clients, args.processes, args.phase_seconds, args.ramp)
+            level = {'clients': num_clients, 'connect_failures': len(failures),
+                     'events': {event: summarize(values) for event, values in latencies.items()}}
+            results.append(level)
+
+            print(f"\n{num_clients} clients ({len(failures)} failed to connect)")
+            for event, s in level['events'].items():
+                if s is None:
+                    print(f"  {event:<18} no updates received")
+                else:
+                    print(f"  {event:<18} {s['count']:>8} updates  p50 {s['p50']:8.1f} ms  p90 {s['p90']:8.1f} ms  "
+                          f"p99 {s['p99']:8.1f} ms  max {s['max']:8.1f} ms")
+    finally:
+        if backend:
+            backend.terminate()
+            backend.wait()
+            # Only remove the recording if this run created it.
+            if not had_recording and os.path.exists(recording_file):
+                os.remove(recording_file)
+        await device.stop()
+    return results
+
+# --- Command Line Entry Point ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure dashboard update latency with many concurrent Socket.IO clients.")
+    parser.add_argument('--clients', type=int, nargs='+', default=[50, 100, 200], help="Client counts to test, in turn")
+    parser.add_argument('--phase-seconds', type=float, default=10, help="Length of each phase of the session")
+    parser.add_argument('--ramp', type=float, default=5, help="Seconds over which the viewers connect")
+    parser.add_argument('--processes', type=int, default=min(4, os.cpu_count() or 1), help="Client worker processes")
+    parser.add_argument('--rate', type=float, default=SAMPLE_RATE_HZ, help="Simulated device packets per second")
+    parser.add_argument('--recordings', nargs='+', default=DEFAULT_RECORDINGS, help="Recordings the device replays")
+    parser.add_argument('--url', default=None, help="Use this running backend instead of starting one")
+    parser.add_argument('--device-port', type=int, default=0, help="Simulated device TCP port (default: any free port)")
+    parser.add_argument('--server-log', default=None, help="Write the started backend's output to this file")
+    parser.add_argument('--json', default=None, help="Also save the results to this JSON file")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    if args.json and results:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved: {args.json}")
@@ -3,16 +3,24 @@ import time
 import torch
 import numpy as np
 import joblib
-from flask import Flask
-from flask_socketio import SocketIO, emit
-import eventlet
-import os 
+import asyncio
+import socketio
+import uvicorn
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-from train_model import HARModel, WINDOW_SIZE, STEP_SIZE, ACTIVITIES, NUM_CLASSES, parse_full_packet, train_model
-from shared_config import SERIAL_PORT, BAUD_RATE
+from features import DEFAULT_FEATURES, FeatureStream
+from resample import StreamResampler
+from motion_gate import MotionGate, gate_statistic
+
+from train_model import WINDOW_SIZE, STEP_SIZE, ACTIVITIES, BASE_MODEL_FILE, parse_full_packet, train_model, fine_tune_model, update_model, load_checkpoint
+from shared_config import CASCADE_ENABLED, SEQUENCE_KEY, SAMPLE_RATE_HZ, MODEL_SAMPLE_RATE_HZ, update_activity_seconds, warning_level
+from serial_link import SerialLink
 
 # --- Configuration ---
 MAX_ACTIVITY_SECONDS = 300  # 5 minute default, but can be changed in frontend
+FULL_SNAPSHOT_EVERY = 20  # Send a full snapshot after this many deltas so clients can resync
+CASCADE_REPORT_EVERY = 100  # Log the motion gate's share of decisions after this many windows
 
 # --- Colours ---
 COLOUR_ACTIVE = "RGB:0,100,255\n"  # Blue
@@ -23,10 +31,11 @@ COLOUR_SLEEP  = "RGB:0,0,50\n"     # Dim Blue
 COLOUR_RECORDING = "RGB:0,255,0\n" # Green
 
 # --- Global Variables ---
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your_secret_key!'
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
-ser = None 
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins="*")
+link = SerialLink()  # Finds the device, reconnects and replays the display state
+# CPU-bound work runs off the event loop so the device and the clients are never kept waiting.
+inference_executor = ThreadPoolExecutor(max_workers=1)  # One window at a time, in order
+training_executor = ThreadPoolExecutor(max_workers=1)   # One training run at a time
 
 # Patient state
 device_state = "sleeping"
@@ -35,34 +44,137 @@ current_activity = "..."
 current_patient_id = "test"
 model = None
 scaler = None
+window_size = WINDOW_SIZE  # Window parameters of the loaded model (stored in its checkpoint)
+step_size = STEP_SIZE
+resampler = StreamResampler(SAMPLE_RATE_HZ, MODEL_SAMPLE_RATE_HZ)  # Brings the firmware's stream to the model's sample rate
+feature_stream = FeatureStream(DEFAULT_FEATURES)  # Computes the loaded model's features one sample at a time
+data_window = []  # Feature rows of the most recent samples
+raw_window = []   # The matching raw [X, Y, Z] samples, for the motion gate
+gate = None       # The loaded model's motion gate (cascade inference), if it has one
+cascade_stats = {'windows': 0, 'gated': 0}
 
 temp_readings = []
 sleep_start_time = None  # Track when sleep mode started
 
 is_recording = False
 current_recording_file = None
+recording_patient_id = None
+recording_sid = None
+
+# Subscriptions
+room_views = {}          # {room: {event: last payload sent to that room}}
+room_delta_counts = {}   # {room: {event: deltas sent since the last full snapshot}}
+followers = set()        # sids following whichever patient the device is monitoring
 
 # --- Serial Communication Function ---
 def send_serial_command(command_str):
-    if ser and ser.is_open:
-        try:
-            print(f"Sending to Arduino: {command_str.strip()}")
-            bytes_written = ser.write(command_str.encode('ascii'))
-            print(f"  -> Wrote {bytes_written} bytes")
-            ser.flush()  # Force immediate write without buffering
-            print(f"  -> Flushed successfully")
-        except serial.SerialTimeoutException:
-            print(f"  -> ERROR: Write timeout - Arduino not responding")
-        except Exception as e:
-            print(f"  -> ERROR writing to serial: {e}")
+    # Display commands are cached by the link and replayed after a reconnect, even if sent while disconnected.
+    try:
+        print(f"Sending to Arduino: {command_str.strip()}")
+        bytes_written = link.write(command_str)
+        print(f"  -> Wrote {bytes_written} bytes")
+    except Exception as e:
+        print(f"  -> ERROR writing to serial: {e}")
 
 def format_lcd(line1, line2=""):
     return f"L:{line1}|{line2}\n"
 
+# --- Subscription Rooms & Delta Updates ---
+def patient_room(patient_id):
+    return f"patient:{patient_id}"
+
+def state_snapshot():
+    return {
+        'state': device_state,
+        'seconds': int(activity_seconds),
+        'activity': current_activity,
+        'patient': current_patient_id,
+        'maxSeconds': MAX_ACTIVITY_SECONDS
+    }
+
+def activity_snapshot():
+    return {'activity': current_activity, 'seconds': int(activity_seconds), 'warning': ''}
+
+def sleep_snapshot():
+    # Returns the current sleep statistics, or None if there is nothing to report yet.
+    if not temp_readings:
+        return None
+    sleep_duration = 0
+    if sleep_start_time:
+        sleep_duration = int(time.time() - sleep_start_time)
+    return {
+        'temp': {'avg': round(np.mean(temp_readings), 2), 'min': min(temp_readings), 'max': max(temp_readings), 'last': temp_readings[-1]},
+        'sleepDuration': sleep_duration
+    }
+
+async def emit_delta(event, payload, patient_id=None, full=False):
+    # Sends `payload` to the patient's room as a delta against what the room last received.
+    # A client joining a room is sent the room's last payloads (see send_snapshot), and a room is resynced
+    # whenever the device starts monitoring its patient, so the room's last payload is what each client has.
+    room = patient_room(patient_id or current_patient_id)
+    views = room_views.setdefault(room, {})
+    counts = room_delta_counts.setdefault(room, {})
+    last = views.get(event)
+
+    if full or last is None or counts.get(event, 0) >= FULL_SNAPSHOT_EVERY:
+        views[event] = dict(payload)
+        counts[event] = 0
+        message = dict(payload, full=True)
+    else:
+        message = {key: value for key, value in payload.items() if key not in last or last[key] != value}
+        if not message:
+            return  # Nothing changed, nothing to send
+        last.update(message)
+        counts[event] += 1
+        message['full'] = False
+
+    await sio.emit(event, message, to=room)
+
+async def send_snapshot(sid, patient_id):
+    # Brings one client up to date, e.g. after it subscribes, without resending anything to the rest of the room.
+    # It gets the room's last payloads, so the deltas the room receives next apply to what it has.
+    # Only the patient on the device has live state; other rooms just get training/recording events.
+    if patient_id != current_patient_id:
+        return
+    views = room_views.get(patient_room(patient_id), {})
+    await sio.emit('link_status', link.status(), to=sid)
+    # Without a last payload the room's next update is a full one anyway.
+    await sio.emit('state_update', dict(views.get('state_update') or state_snapshot(), full=True), to=sid)
+    activity = dict(views.get('activity_update') or activity_snapshot(), full=True)
+    activity.pop('sample', None)  # Names the packet behind the room's last update, which this client didn't just get
+    await sio.emit('activity_update', activity, to=sid)
+    if device_state == 'sleeping':
+        sleep_data = sleep_snapshot()
+        if sleep_data:
+            await sio.emit('sleep_data_update', sleep_data, to=sid)
+
+async def resync_room(patient_id):
+    # Sends everyone in the patient's room full snapshots. The room's last payloads may date from
+    # before its members joined (e.g. from when the patient was last on the device).
+    room = patient_room(patient_id)
+    await sio.emit('link_status', link.status(), to=room)
+    await emit_delta('state_update', state_snapshot(), patient_id, full=True)
+    await emit_delta('activity_update', activity_snapshot(), patient_id, full=True)
+    if device_state == 'sleeping':
+        sleep_data = sleep_snapshot()
+        if sleep_data:
+            await sio.emit('sleep_data_update', sleep_data, to=room)
+
+async def move_followers(old_patient_id, new_patient_id):
+    # Followers track the device rather than a fixed patient, so they change rooms with it.
+    # The new patient's room is resynced even without followers, as its clients have no live state yet.
+    if old_patient_id == new_patient_id:
+        return
+    for sid in list(followers):  # Followers can (un)subscribe while this waits
+        await sio.leave_room(sid, patient_room(old_patient_id))
+        await sio.enter_room(sid, patient_room(new_patient_id))
+    await resync_room(new_patient_id)
+
 # --- ML Model Loader ---
 def load_model(patient_id):
     # Loads a specific patient's model and scaler into memory.
-    global model, scaler, current_patient_id
+    # Callers move the followers if this changes current_patient_id.
+    global model, scaler, current_patient_id, window_size, step_size, resampler, feature_stream, data_window, raw_window, gate
     try:
         model_path = f'{patient_id}_model.pth'
         scaler_path = f'{patient_id}_scaler.joblib'
@@ -87,12 +199,18 @@ def load_model(patient_id):
                 scaler = None
                 return False
 
-        model = HARModel(num_classes=NUM_CLASSES)
-        model.load_state_dict(torch.load(model_path))
-        model.eval()
+        model, model_config = load_checkpoint(model_path)
         scaler = joblib.load(scaler_path)
+        window_size, step_size = model_config['window_size'], model_config['step_size']
+        # A new model may use a different sample rate and features, so start the live stream afresh.
+        resampler = StreamResampler(SAMPLE_RATE_HZ, model_config['sample_rate'])
+        feature_stream = FeatureStream(model_config['features'])
+        data_window = []
+        raw_window = []
+        gate = MotionGate.from_dict(model_config.get('gate'))
         current_patient_id = patient_id
-        print(f"Successfully loaded model and scaler for patient: {patient_id}")
+        print(f"Successfully loaded model and scaler for patient: {patient_id} "
+              f"(window {model_config['window_seconds']:g}s, step {model_config['step_seconds']:g}s at {model_config['sample_rate']:g} Hz)")
         return True
     except Exception as e:
         print(f"--- ERROR loading model: {e} ---")
@@ -102,31 +220,53 @@ def load_model(patient_id):
         return False
 
 # --- Web API (Socket.IO) ---
-@socketio.on('connect')
-def handle_connect():
-    # Called when React frontend connects.
+@sio.on('connect')
+async def handle_connect(sid, environ):
+    # Called when React frontend connects. Nothing is streamed until the client subscribes.
     print("React frontend connected.")
-    emit('state_update', {
-        'state': device_state,
-        'seconds': activity_seconds,
-        'activity': current_activity,
-        'patient': current_patient_id,
-        'maxSeconds': MAX_ACTIVITY_SECONDS
-    })
-
-    if device_state == 'sleeping' and temp_readings:
-        # Calculate sleep duration
-        sleep_duration = 0
-        if sleep_start_time:
-            sleep_duration = int(time.time() - sleep_start_time)
-
-        emit('sleep_data_update', {
-            'temp': {'avg': round(np.mean(temp_readings), 2), 'min': min(temp_readings), 'max': max(temp_readings), 'last': temp_readings[-1]},
-            'sleepDuration': sleep_duration
-        })
 
-@socketio.on('set_state')
-def handle_set_state(data):
+@sio.on('disconnect')
+async def handle_disconnect(sid, *args):
+    # Socket.IO removes the client from its rooms; only the follower set needs cleanup.
+    followers.discard(sid)
+
+@sio.on('subscribe')
+async def handle_subscribe(sid, data=None):
+    # Subscribes the client to one or more patients' streams.
+    # Without a patient list the client follows whichever patient the device is monitoring.
+    data = data or {}
+    patient_ids = data.get('patients') or ([data['patient_id']] if data.get('patient_id') else [])
+
+    if not patient_ids:
+        followers.add(sid)
+        patient_ids = [current_patient_id]
+
+    for patient_id in patient_ids:
+        await sio.enter_room(sid, patient_room(patient_id))
+        print(f"Client {sid} subscribed to patient: {patient_id}")
+        await send_snapshot(sid, patient_id)
+
+@sio.on('unsubscribe')
+async def handle_unsubscribe(sid, data=None):
+    data = data or {}
+    patient_ids = data.get('patients') or ([data['patient_id']] if data.get('patient_id') else [])
+
+    if not patient_ids:
+        followers.discard(sid)
+        patient_ids = [current_patient_id]
+
+    for patient_id in patient_ids:
+        await sio.leave_room(sid, patient_room(patient_id))
+        print(f"Client {sid} unsubscribed from patient: {patient_id}")
+
+@sio.on('request_snapshot')
+async def handle_request_snapshot(sid, data=None):
+    # Lets a client that suspects it is out of sync ask for full snapshots (sent to it alone).
+    data = data or {}
+    await send_snapshot(sid, data.get('patient_id') or current_patient_id)
+
+@sio.on('set_state')
+async def handle_set_state(sid, data):
     # Called when React sends a new state.
     global device_state, activity_seconds, temp_readings, sleep_start_time
 
@@ -147,15 +287,10 @@ def handle_set_state(data):
         send_serial_command(format_lcd("Device Sleeping", "Temp. Monitor"))
         send_serial_command(COLOUR_SLEEP)
 
-    emit('state_update', {
-        'state': device_state,
-        'seconds': activity_seconds,
-        'patient': current_patient_id,
-        'maxSeconds': MAX_ACTIVITY_SECONDS
-    })
+    await emit_delta('state_update', state_snapshot())
 
-@socketio.on('set_max_seconds')
-def handle_set_max_seconds(data):
+@sio.on('set_max_seconds')
+async def handle_set_max_seconds(sid, data):
     # Called when React sends a new max activity seconds value.
     global MAX_ACTIVITY_SECONDS, activity_seconds, current_activity
 
@@ -174,8 +309,9 @@ def handle_set_max_seconds(data):
 
             print(f"--- Max activity seconds updated to: {MAX_ACTIVITY_SECONDS} ---")
 
-            emit('max_seconds_update', {'maxSeconds': MAX_ACTIVITY_SECONDS}, broadcast=True)
-            emit('activity_update', {'activity': current_activity, 'seconds': activity_seconds}, broadcast=True)
+            await sio.emit('max_seconds_update', {'maxSeconds': MAX_ACTIVITY_SECONDS}, to=patient_room(current_patient_id))
+            await emit_delta('state_update', state_snapshot())
+            await emit_delta('activity_update', activity_snapshot())
         else:
             print("Ignoring invalid max seconds (must be > 0)")
     except Exception as e:
@@ -183,55 +319,84 @@ def handle_set_max_seconds(data):
 
 # --- Frontend Training API Call ---
 
-@socketio.on('start_recording')
-def handle_start_recording(data):
-    global is_recording, current_recording_file
+@sio.on('start_recording')
+async def handle_start_recording(sid, data):
+    global is_recording, current_recording_file, recording_patient_id, recording_sid
     patient_id = data.get('patient_id', 'test')
     activity = data.get('activity')
     if is_recording or not activity: return
+    # A new recording replaces the activity's data; with 'append' the session is added to it instead,
+    # and incremental training then picks up only the added samples.
+    append = bool(data.get('append'))
     filename = f"{patient_id}_{activity}.csv"
     try:
-        current_recording_file = open(filename, 'w')
+        current_recording_file = open(filename, 'a' if append else 'w')
+        # Each session notes the rate it is recorded at, so training can resample it to the model's rate.
+        current_recording_file.write(f"#RATE:{SAMPLE_RATE_HZ:g}\n")
         is_recording = True
-        print(f"--- START RECORDING: Saving to {filename} ---")
+        recording_patient_id = patient_id
+        recording_sid = sid
+        print(f"--- START RECORDING: {'Adding to' if append else 'Saving to'} {filename} ---")
         send_serial_command(format_lcd("REC: Starting...", f"{activity.upper()}"))
         send_serial_command(COLOUR_RECORDING) 
-        emit('recording_status', {'recording': True, 'activity': activity})
+        await sio.emit('recording_status', {'recording': True, 'activity': activity}, to=sid)
     except Exception as e:
         print(f"Error opening file: {e}")
 
-@socketio.on('stop_recording')
-def handle_stop_recording():
-    global is_recording, current_recording_file
+@sio.on('stop_recording')
+async def handle_stop_recording(sid, data=None):
+    global is_recording, current_recording_file, recording_patient_id, recording_sid
     if not is_recording: return
     is_recording = False
+    recording_patient_id = None
+    recording_sid = None
     if current_recording_file:
         current_recording_file.close()
         current_recording_file = None
     print(f"--- STOP RECORDING ---")
     send_serial_command(format_lcd("REC: Stopped.", ""))
     send_serial_command(COLOUR_ACTIVE)
-    emit('recording_status', {'recording': False})
+    await sio.emit('recording_status', {'recording': False}, to=sid)
 
-@socketio.on('train_model')
-def handle_train_model(data):
+@sio.on('train_model')
+async def handle_train_model(sid, data):
+    # mode: 'scratch', 'finetune' (from the population base model), 'incremental' (continue the existing model
+    # on newly recorded data) or 'auto' (incremental if the patient has a model, else fine-tune if a base model exists).
     patient_id = data.get('patient_id', 'test')
-    print(f"Received request to train model for: {patient_id}")
+    mode = data.get('mode', 'auto')
+    if mode == 'auto':
+        if os.path.exists(f"{patient_id}_model.pth"):
+            mode = 'incremental'
+        elif os.path.exists(BASE_MODEL_FILE):
+            mode = 'finetune'
+        else:
+            mode = 'scratch'
+    print(f"Received request to train model for: {patient_id} ({mode})")
     send_serial_command(format_lcd("Training Model...", "Please wait."))
     
+    requester_sid = sid
+    loop = asyncio.get_running_loop()
+
+    async def send_training_status(message):
+        # Sent to the requesting client and to anyone subscribed to the patient being trained.
+        await sio.emit('training_status', {'message': message}, to=requester_sid)
+        await sio.emit('training_status', {'message': message}, to=patient_room(patient_id), skip_sid=requester_sid)
+
     def training_status_callback(message):
+        # Called from the training thread, so the emits are handed over to the event loop.
         print(f"[Train Status] {message}")
-        socketio.emit('training_status', {'message': message})
-    
-    socketio.start_background_task(train_model_wrapper, patient_id, training_status_callback)
-    
-def train_model_wrapper(patient_id, callback):
-    if train_model(patient_id, callback):
+        asyncio.run_coroutine_threadsafe(send_training_status(message), loop)
+
+    sio.start_background_task(train_model_wrapper, patient_id, training_status_callback, mode)
+
+async def train_model_wrapper(patient_id, callback, mode='scratch'):
+    trainer = {'finetune': fine_tune_model, 'incremental': update_model}.get(mode, train_model)
+    loop = asyncio.get_running_loop()
+    if await loop.run_in_executor(training_executor, trainer, patient_id, callback):
+        old_patient_id = current_patient_id
         load_model(patient_id)
-        socketio.emit('state_update', {
-            'patient': current_patient_id, 
-            'threshold': MAX_ACTIVITY_SECONDS
-        })
+        await move_followers(old_patient_id, current_patient_id)
+        await emit_delta('state_update', state_snapshot())
         send_serial_command(format_lcd("Training Done!", "Ready."))
         send_serial_command(COLOUR_ACTIVE)
     else:
@@ -239,199 +404,206 @@ def train_model_wrapper(patient_id, callback):
         send_serial_command(format_lcd("Training FAILED", "See console."))
         send_serial_command(COLOUR_ALERT)
 
-# --- Main Hardware and ML Thread ---
-def hardware_loop():
-    # The main background thread that reads from serial, runs the model,
+# --- Inference ---
+async def classify_window(window_raw, window_features):
+    # Cascade inference: the motion gate decides clear-cut windows, the CNN only runs on ambiguous ones.
+    # Returns the index of the predicted activity.
+    cascade_stats['windows'] += 1
+    if cascade_stats['windows'] % CASCADE_REPORT_EVERY == 0:
+        print(f"Cascade: motion gate decided {100 * cascade_stats['gated'] / cascade_stats['windows']:.1f}% "
+              f"of {cascade_stats['windows']} windows")
+
+    if CASCADE_ENABLED and gate is not None:
+        decision = int(gate.decide(gate_statistic(window_raw)))
+        if decision >= 0:
+            cascade_stats['gated'] += 1
+            return decision
+
+    # The CNN is CPU-bound, so it runs in the inference thread while the event loop keeps serving.
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_executor, run_model, model, scaler, window_features)
+
+def run_model(model, scaler, window_features):
+    # Scale and prepare for model
+    window_scaled = scaler.transform(window_features)
+    window_tensor = torch.from_numpy(window_scaled).unsqueeze(0).permute(0, 2, 1)
+
+    with torch.no_grad():
+        outputs = model(window_tensor)
+        _, predicted_idx = torch.max(outputs, 1)
+    return predicted_idx.item()
+
+# --- Main Hardware and ML Task ---
+async def hardware_loop():
+    # The main background task that reads from serial, runs the model,
     # and manages the application logic.
-    global device_state, activity_seconds, current_activity, temp_readings, ser, sleep_start_time
-    global is_recording, current_recording_file
+    global device_state, activity_seconds, current_activity, temp_readings, sleep_start_time
+    global is_recording, current_recording_file, data_window, raw_window
 
-    data_window = []
     last_activity_update_time = time.time()  # Track when we last updated activity
     
     while True:
         try:
-            if ser is None or not ser.is_open:
-                print("Attempting to connect to serial port...")
-                ser = serial.Serial(
-                    SERIAL_PORT,
-                    BAUD_RATE,
-                    timeout=1,
-                    write_timeout=2,  # Increased write timeout
-                    dsrdtr=False,     # Disable Data Terminal (DTR) (prevents Arduino reset)
-                    rtscts=False      # Disable Request to Send and Clear to Send (RTS/CTS) flow control
-                )
-                print("Serial port opened. Waiting for Arduino to be ready...")
-                time.sleep(3)  # Give Arduino time to initialize
-
-                # Clear any stale data in buffers
-                ser.reset_input_buffer()
-                ser.reset_output_buffer()
-                print("Buffers cleared.")
-
-                print("Serial connection established.")
-                if device_state == "sleeping":
-                    send_serial_command(format_lcd("Device Sleeping", "Temp. Monitor"))
-                    time.sleep(0.2)  # Increased delay between commands
-                    send_serial_command(COLOUR_SLEEP)
-                else:
-                    send_serial_command(format_lcd("Device Active", "Activity Mode"))
-                    time.sleep(0.2)  # Increased delay between commands
-                    send_serial_command(COLOUR_ACTIVE)
-            
-            if ser.in_waiting > 0:
-                line_bytes = ser.readline()
-                data_str = line_bytes.decode('ascii', errors='ignore').strip()
-                if not data_str or not data_str.startswith("T:"):
+            if not link.is_open:
+                if not link.display_cache:
+                    # First connection: the device shows the current mode as soon as it answers.
+                    if device_state == "sleeping":
+                        send_serial_command(format_lcd("Device Sleeping", "Temp. Monitor"))
+                        send_serial_command(COLOUR_SLEEP)
+                    else:
+                        send_serial_command(format_lcd("Device Active", "Activity Mode"))
+                        send_serial_command(COLOUR_ACTIVE)
+                print("Connecting to serial device...")
+                await link.connect()
+                await sio.emit('link_status', link.status(), to=patient_room(current_patient_id))
+
+            line_bytes = await link.readline()
+            data_str = line_bytes.decode('ascii', errors='ignore').strip()
+            if not data_str or not data_str.startswith("T:"):
+                continue
+                
+            # --- Data Recording Logic ---
+            if is_recording and current_recording_file:
+                current_recording_file.write(data_str + '\n')
+                await sio.emit('live_data', {'data': data_str}, to=recording_sid)
+                await sio.emit('live_data', {'data': data_str}, to=patient_room(recording_patient_id), skip_sid=recording_sid)
+
+            # --- State-Based Logic (only if not recording) ---
+            if not is_recording:
+                parsed_dict = parse_full_packet(data_str)
+                if not parsed_dict: 
                     continue
                 
-                # --- Data Recording Logic ---
-                if is_recording and current_recording_file:
-                    current_recording_file.write(data_str + '\n')
-                    socketio.emit('live_data', {'data': data_str}) 
-
-                # --- State-Based Logic (only if not recording) ---
-                if not is_recording:
-                    parsed_dict = parse_full_packet(data_str)
-                    if not parsed_dict: 
+                if device_state == "active":
+                    # --- ACTIVE STATE LOGIC ---
+                    if 'X' not in parsed_dict or 'Y' not in parsed_dict or 'Z' not in parsed_dict:
                         continue
-                    
-                    if device_state == "active":
-                        # --- ACTIVE STATE LOGIC ---
-                        if 'X' not in parsed_dict or 'Y' not in parsed_dict or 'Z' not in parsed_dict:
+
+                    # The sample is resampled to the model's rate (giving zero or more samples), then features are
+                    # computed incrementally, so each sample costs the same however rich they are.
+                    sample = [parsed_dict['X'], parsed_dict['Y'], parsed_dict['Z']]
+                    for model_sample in resampler.push(sample):
+                        data_window.append(feature_stream.push(model_sample))
+                        raw_window.append(model_sample)
+
+                    # One packet can complete several windows (e.g. when upsampling with a short step),
+                    # so classify each in turn to stay aligned to the step.
+                    while len(data_window) >= window_size:
+                        if model is None or scaler is None:
+                            print("Model or scaler not loaded, skipping prediction.")
+                            data_window = data_window[step_size:]
+                            raw_window = raw_window[step_size:]
                             continue
 
-                        data_window.append([parsed_dict['X'], parsed_dict['Y'], parsed_dict['Z']])
-
-                        if len(data_window) == WINDOW_SIZE:
-                            if model is None or scaler is None:
-                                print("Model or scaler not loaded, skipping prediction.")
-                                data_window = data_window[STEP_SIZE:]
-                                continue
-
-                            # Convert to numpy array
-                            window_np = np.array(data_window, dtype=np.float32)
-
-                            # Compute motion features (deltas)
-                            deltas = np.zeros_like(window_np)
-                            deltas[1:] = np.diff(window_np, axis=0)
-                            deltas[0] = deltas[1]
-
-                            # Combine raw data with velocity features (6 channels total)
-                            window_features = np.concatenate([window_np, deltas], axis=1)
-
-                            # Scale and prepare for model
-                            window_scaled = scaler.transform(window_features)
-                            window_tensor = torch.from_numpy(window_scaled).unsqueeze(0).permute(0, 2, 1)
-
-                            with torch.no_grad():
-                                outputs = model(window_tensor)
-                                _, predicted_idx = torch.max(outputs, 1)
-
-                            current_activity = ACTIVITIES[predicted_idx.item()]
-
-                            # Update activity seconds based on elapsed time
-                            current_time = time.time()
-                            elapsed = current_time - last_activity_update_time
-                            last_activity_update_time = current_time
-
-                            if current_activity == 'still':
-                                # Decrease by elapsed seconds
-                                activity_seconds = max(0, activity_seconds - elapsed)
-                            else:  # active
-                                # Increase by five times the elapsed seconds (recover faster)
-                                activity_seconds = min(MAX_ACTIVITY_SECONDS, activity_seconds + (5 * elapsed))
-
-                            # Calculate progress percentage
-                            progress_percent = 0
-                            if MAX_ACTIVITY_SECONDS > 0:
-                                progress_percent = activity_seconds / MAX_ACTIVITY_SECONDS
-
-                            # Create visual progress bar (10 chars wide to fit on 16-char LCD)
-                            bar_width = 10
-                            filled = int(progress_percent * bar_width)
-                            bar = "[" + ("=" * filled) + ("-" * (bar_width - filled)) + "]"
-
-                            # Format activity display
-                            activity_char = current_activity[0].upper()  # 'S' (still) or 'A' (active)
-
-                            # Determine warning level and set LCD color
-                            warning_text = ""
-                            if activity_seconds <= 0:
-                                # 0% - Last warning (Red)
-                                send_serial_command(COLOUR_ALERT)
-                                warning_text = "MOVE NOW!"
-                                send_serial_command(format_lcd("!! MOVE NOW !!", bar))
-                                socketio.emit('status_update', {'alert': 'inactive'})
-                            elif progress_percent <= 0.10:
-                                # 10% - Warning 2 (Red-Orange)
-                                send_serial_command(COLOUR_WARNING_2)
-                                warning_text = "WARN2"
-                                send_serial_command(format_lcd(f"{activity_char}:{current_activity} {warning_text}", bar))
-                            elif progress_percent <= 0.30:
-                                # 30% - Warning 1 (Orange)
-                                send_serial_command(COLOUR_WARNING_1)
-                                warning_text = "WARN1"
-                                send_serial_command(format_lcd(f"{activity_char}:{current_activity} {warning_text}", bar))
-                            else:
-                                # Normal - Blue
-                                send_serial_command(COLOUR_ACTIVE)
-                                send_serial_command(format_lcd(f"{activity_char}:{current_activity}", bar))
-
-                            socketio.emit('activity_update', {
-                                'activity': current_activity,
-                                'seconds': int(activity_seconds),
-                                'warning': warning_text
-                            })
-                            data_window = data_window[STEP_SIZE:]
-
-                    elif device_state == "sleeping":
-                        # --- SLEEPING STATE LOGIC ---
-                        temp = parsed_dict.get('T', 0)
-
-                        temp_readings.append(temp)
-
-                        if len(temp_readings) > 100:
-                            temp_readings.pop(0)
-
-                        # Calculate sleep duration
-                        sleep_duration = 0
-                        if sleep_start_time:
-                            sleep_duration = int(time.time() - sleep_start_time)
-
-                        # Format sleep duration for LCD (HH:MM:SS)
-                        hours = sleep_duration // 3600
-                        minutes = (sleep_duration % 3600) // 60
-                        seconds_part = sleep_duration % 60
-                        duration_str = f"{hours:02d}:{minutes:02d}:{seconds_part:02d}"
-
-                        # Display temperature and sleep duration on LCD
-                        temp_str = f"Temp: {temp:.1f}C"
-                        sleep_str = f"Sleep: {duration_str}"
-                        send_serial_command(format_lcd(temp_str, sleep_str))
-
-                        socketio.emit('sleep_data_update', {
-                            'temp': {'avg': round(np.mean(temp_readings), 2), 'min': min(temp_readings), 'max': max(temp_readings), 'last': temp},
-                            'sleepDuration': sleep_duration
-                        })
-
-            eventlet.sleep(0.01) 
-
-        except serial.SerialException:
-            if ser: ser.close()
-            ser = None
-            print("Serial port disconnected. Retrying in 5 seconds...")
-            eventlet.sleep(5)
+                        # Stack the samples into (window_size, channels) arrays
+                        window_features = np.array(data_window[:window_size], dtype=np.float32)
+                        window_raw = np.array(raw_window[:window_size], dtype=np.float32)
+
+                        current_activity = ACTIVITIES[await classify_window(window_raw, window_features)]
+
+                        # Update activity seconds based on elapsed time
+                        current_time = time.time()
+                        elapsed = current_time - last_activity_update_time
+                        last_activity_update_time = current_time
+
+                        # Decreases while still, recovers five times faster while active
+                        activity_seconds = update_activity_seconds(activity_seconds, current_activity, elapsed, MAX_ACTIVITY_SECONDS)
+
+                        # Calculate progress percentage
+                        progress_percent = 0
+                        if MAX_ACTIVITY_SECONDS > 0:
+                            progress_percent = activity_seconds / MAX_ACTIVITY_SECONDS
+
+                        # Create visual progress bar (10 chars wide to fit on 16-char LCD)
+                        bar_width = 10
+                        filled = int(progress_percent * bar_width)
+                        bar = "[" + ("=" * filled) + ("-" * (bar_width - filled)) + "]"
+
+                        # Format activity display
+                        activity_char = current_activity[0].upper()  # 'S' (still) or 'A' (active)
+
+                        # Determine warning level and set LCD color
+                        warning_text = warning_level(activity_seconds, MAX_ACTIVITY_SECONDS)
+                        if warning_text == "MOVE NOW!":
+                            # 0% - Last warning (Red)
+                            send_serial_command(COLOUR_ALERT)
+                            send_serial_command(format_lcd("!! MOVE NOW !!", bar))
+                            await sio.emit('status_update', {'alert': 'inactive'}, to=patient_room(current_patient_id))
+                        elif warning_text == "WARN2":
+                            # 10% - Warning 2 (Red-Orange)
+                            send_serial_command(COLOUR_WARNING_2)
+                            send_serial_command(format_lcd(f"{activity_char}:{current_activity} {warning_text}", bar))
+                        elif warning_text == "WARN1":
+                            # 30% - Warning 1 (Orange)
+                            send_serial_command(COLOUR_WARNING_1)
+                            send_serial_command(format_lcd(f"{activity_char}:{current_activity} {warning_text}", bar))
+                        else:
+                            # Normal - Blue
+                            send_serial_command(COLOUR_ACTIVE)
+                            send_serial_command(format_lcd(f"{activity_char}:{current_activity}", bar))
+
+                        activity_update = {
+                            'activity': current_activity,
+                            'seconds': int(activity_seconds),
+                            'warning': warning_text
+                        }
+                        if SEQUENCE_KEY in parsed_dict:
+                            # The sample that completed this window (simulated device only)
+                            activity_update['sample'] = int(parsed_dict[SEQUENCE_KEY])
+                        await emit_delta('activity_update', activity_update)
+                        data_window = data_window[step_size:]
+                        raw_window = raw_window[step_size:]
+
+                elif device_state == "sleeping":
+                    # --- SLEEPING STATE LOGIC ---
+                    temp = parsed_dict.get('T', 0)
+
+                    temp_readings.append(temp)
+
+                    if len(temp_readings) > 100:
+                        temp_readings.pop(0)
+
+                    # Calculate sleep duration
+                    sleep_duration = 0
+                    if sleep_start_time:
+                        sleep_duration = int(time.time() - sleep_start_time)
+
+                    # Format sleep duration for LCD (HH:MM:SS)
+                    hours = sleep_duration // 3600
+                    minutes = (sleep_duration % 3600) // 60
+                    seconds_part = sleep_duration % 60
+                    duration_str = f"{hours:02d}:{minutes:02d}:{seconds_part:02d}"
+
+                    # Display temperature and sleep duration on LCD
+                    temp_str = f"Temp: {temp:.1f}C"
+                    sleep_str = f"Sleep: {duration_str}"
+                    send_serial_command(format_lcd(temp_str, sleep_str))
+
+                    sleep_data = {
+                        'temp': {'avg': round(np.mean(temp_readings), 2), 'min': min(temp_readings), 'max': max(temp_readings), 'last': temp},
+                        'sleepDuration': sleep_duration
+                    }
+                    if SEQUENCE_KEY in parsed_dict:
+                        sleep_data['sample'] = int(parsed_dict[SEQUENCE_KEY])
+                    await sio.emit('sleep_data_update', sleep_data, to=patient_room(current_patient_id))
+
+        except (serial.SerialException, OSError):
+            link.mark_disconnected()
+            print("Serial port disconnected. Reconnecting...")
+            await sio.emit('link_status', link.status(), to=patient_room(current_patient_id))
         except Exception as e:
             print(f"An error occurred in hardware_loop: {e}")
-            eventlet.sleep(1)
+            await asyncio.sleep(1)
 
 # --- Start Everything ---
-if __name__ == '__main__':
+async def start_background_tasks():
+    # Runs on the ASGI startup event, so serving `app` any other way (e.g. `uvicorn main:app`) starts up the same.
     load_model(current_patient_id) # Load the default ("test") model
-    
-    print("Starting hardware background thread...")
-    socketio.start_background_task(hardware_loop)
-    
-    print("Starting Flask-SocketIO server at http://127.0.0.1:5000 ...")
-    socketio.run(app, host='0.0.0.0', port=5000)
\ No newline at end of file
+    print("Starting hardware background task...")
+    sio.start_background_task(hardware_loop)
+
+app = socketio.ASGIApp(sio, on_startup=start_background_tasks)
+
+if __name__ == '__main__':
+    print("Starting Socket.IO server at http://127.0.0.1:5000 ...")
+    uvicorn.run(app, host='0.0.0.0', port=5000, log_level='warning')
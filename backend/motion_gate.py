@@ -0,0 +1,87 @@
+"""
+Cheap motion gate in front of the CNN (cascade inference).
+
+Most windows on a bedbound patient are obviously still or obviously active.
+The gate looks at one number per window, the standard deviation of the
+acceleration magnitude, and compares it with two per-patient thresholds
+fit during training:
+  - at or below `low`  -> 'still'
+  - at or above `high` -> 'active'
+  - in between         -> ambiguous, sent to the CNN.
+Each threshold is set so that the windows it decides reach GATE_CONFIDENCE
+precision on the training data. A model only keeps its gate if the cascade
+is about as accurate as the CNN alone on validation data (see fit_gate in
+train_model.py); otherwise it is stored without one.
+"""
+import numpy as np
+
+from shared_config import ACTIVITIES, GATE_CONFIDENCE, GATE_MIN_SUPPORT
+
+STILL = ACTIVITIES.index('still')
+ACTIVE = ACTIVITIES.index('active')
+
+def gate_statistic(raw_windows):
+    # Standard deviation of the acceleration magnitude within each window.
+    # raw_windows: (..., window_size, 3) raw [X, Y, Z] samples. Returns one value per window.
+    magnitude = np.linalg.norm(np.asarray(raw_windows, dtype=np.float32), axis=-1)
+    return magnitude.std(axis=-1)
+
+def _prefix_threshold(stats, positive, confidence, min_support):
+    # Largest index k such that the k+1 smallest stats are at least `confidence` positive.
+    # Only cut between distinct values, so every window with the threshold value gets the same decision.
+    counts = np.arange(1, len(stats) + 1)
+    precision = np.cumsum(positive) / counts
+    distinct = np.append(stats[1:] > stats[:-1], True)
+    valid = np.nonzero((precision >= confidence) & (counts >= min_support) & distinct)[0]
+    return valid.max() if len(valid) else None
+
+class MotionGate:
+    def __init__(self, low=-np.inf, high=np.inf):
+        self.low = float(low)
+        self.high = float(high)
+
+    @classmethod
+    def fit(cls, stats, labels, confidence=GATE_CONFIDENCE, min_support=GATE_MIN_SUPPORT):
+        # Fits the thresholds on per-window statistics and their true labels.
+        order = np.argsort(stats)
+        stats, labels = np.asarray(stats)[order], np.asarray(labels)[order]
+
+        low, high = -np.inf, np.inf
+        k = _prefix_threshold(stats, labels == STILL, confidence, min_support)
+        if k is not None:
+            low = stats[k]
+        # The same search from the top end, on the reversed (negated) statistics.
+        k = _prefix_threshold(-stats[::-1], labels[::-1] == ACTIVE, confidence, min_support)
+        if k is not None:
+            high = stats[::-1][k]
+        return cls(low, max(low, high))
+
+    def decide(self, stats):
+        # Returns the gate's label for each window, or -1 where the CNN must decide.
+        stats = np.asarray(stats)
+        decisions = np.full(stats.shape, -1, dtype=np.int64)
+        decisions[stats <= self.low] = STILL
+        decisions[(stats >= self.high) & (stats > self.low)] = ACTIVE
+        return decisions
+
+    def to_dict(self):
+        return {'low': self.low, 'high': self.high}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['low'], data['high']) if data else None
+
+def cascade_report(gate, stats, cnn_predictions, labels=None):
+    # Summarises how the cascade would behave on a set of windows:
+    # the fraction decided by the gate and how often its decisions match the CNN (and the truth, if known).
+    decisions = gate.decide(stats)
+    gated = decisions >= 0
+    cascade = np.where(gated, decisions, cnn_predictions)
+    report = {
+        'gated_fraction': float(gated.mean()) if len(gated) else 0.0,
+        'agreement': float((decisions[gated] == cnn_predictions[gated]).mean()) if gated.any() else 1.0,
+    }
+    if labels is not None and len(labels):
+        report['cascade_accuracy'] = float((cascade == labels).mean())
+        report['cnn_accuracy'] = float((cnn_predictions == labels).mean())
+    return report
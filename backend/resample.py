@@ -0,0 +1,111 @@
+"""
+Resampling of accelerometer streams to a model's sample rate.
+
+Models see data at a fixed rate (their 'sample_rate'), whatever rate the
+firmware or a recording delivers. Downsampling first applies a low-pass
+FIR filter (windowed sinc) so fast movements don't alias into the
+slower stream. The filtered signal is then linearly interpolated at the
+output sample times, which handles any ratio between the two rates.
+Upsampling only interpolates. Like the feature extractors, there are two
+forms that give the same results:
+  - resample():         vectorized over a whole recording.
+  - StreamResampler:    incremental, one input sample at a time, used live.
+The filter is causal, so the live stream never waits for future samples.
+Training data passes through the same filter, so its delay (half the
+filter length, 8 output samples whatever the input rate) is the same in both.
+"""
+import math
+from collections import deque
+
+import numpy as np
+
+# --- Configuration ---
+# With these, at whole-number ratios, tones up to 0.8x the output Nyquist frequency keep at least 96% of
+# their amplitude and tones from 1.1x Nyquist (which would alias into the band) are cut to 4% or less.
+# Other ratios lose a little more in the passband to the linear interpolation.
+TAPS_PER_RATIO = 16     # Filter length per unit of decimation ratio (longer filters cut off more sharply)
+CUTOFF_FRACTION = 0.95  # Cutoff as a fraction of the output Nyquist frequency
+
+def lowpass_taps(in_rate, out_rate):
+    # Anti-aliasing FIR filter for going from in_rate to out_rate, normalized to unit gain at DC.
+    # Returns None when no filtering is needed (same rate or upsampling).
+    ratio = in_rate / out_rate
+    if ratio <= 1:
+        return None
+    num_taps = 2 * math.ceil(TAPS_PER_RATIO * ratio / 2) + 1  # Odd, so the filter is symmetric
+    cutoff = CUTOFF_FRACTION * 0.5 / ratio  # In cycles per input sample
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = np.sinc(2 * cutoff * n) * np.hamming(num_taps)
+    return taps / taps.sum()
+
+def output_position(index, in_rate, out_rate):
+    # Position of output sample `index` in input samples (output sample k is at time k / out_rate).
+    return index * in_rate / out_rate
+
+def resample(samples, in_rate, out_rate):
+    # Resamples a whole recording of (num_samples, channels) to out_rate.
+    # Returns every output sample up to the time of the last input sample, as float32.
+    samples = np.asarray(samples, dtype=np.float32)
+    if in_rate == out_rate or len(samples) == 0:
+        return samples
+
+    filtered = samples.astype(np.float64)
+    taps = lowpass_taps(in_rate, out_rate)
+    if taps is not None:
+        # Causal filter; the stream is treated as if the first sample had always been there.
+        padded = np.concatenate([np.repeat(filtered[:1], len(taps) - 1, axis=0), filtered])
+        windows = np.lib.stride_tricks.sliding_window_view(padded, len(taps), axis=0)  # (num_samples, channels, taps)
+        filtered = windows @ taps[::-1]
+
+    num_out = math.floor((len(samples) - 1) * out_rate / in_rate) + 1
+    positions = output_position(np.arange(num_out), in_rate, out_rate)
+    if positions[-1] > len(samples) - 1:
+        num_out -= 1  # Rounding put the last output just past the end
+        positions = positions[:num_out]
+    index = np.floor(positions).astype(np.int64)
+    frac = (positions - index)[:, None]
+    following = np.minimum(index + 1, len(samples) - 1)
+    return (filtered[index] * (1 - frac) + filtered[following] * frac).astype(np.float32)
+
+class StreamResampler:
+    # Incremental resampling for the live stream: push one input sample, get the output samples now due
+    # (none, one or several). Each output is produced as soon as the input sample at or after its time arrives.
+    def __init__(self, in_rate, out_rate):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.taps = lowpass_taps(in_rate, out_rate)
+        self.reset()
+
+    def reset(self):
+        self.history = None   # The last len(taps) input samples, oldest first
+        self.previous = None  # Filtered value of the previous input sample
+        self.count = 0        # Input samples so far
+        self.next_out = 0     # Index of the next output sample
+
+    def push(self, sample):
+        sample = np.asarray(sample, dtype=np.float32)
+        if self.in_rate == self.out_rate:
+            return [sample]
+
+        if self.taps is None:
+            filtered = sample.astype(np.float64)
+        else:
+            if self.history is None:
+                self.history = deque([sample] * len(self.taps), maxlen=len(self.taps))
+            else:
+                self.history.append(sample)
+            filtered = np.array(self.history, dtype=np.float64).T @ self.taps[::-1]
+
+        n = self.count
+        outputs = []
+        while (position := output_position(self.next_out, self.in_rate, self.out_rate)) <= n:
+            index = math.floor(position)
+            frac = position - index
+            # Outputs are produced as soon as they are due, so each lies between the previous sample and this one.
+            start = filtered if index == n else self.previous
+            following = filtered
+            outputs.append((start * (1 - frac) + following * frac).astype(np.float32))
+            self.next_out += 1
+        self.previous = filtered
+        self.count += 1
+        return outputs
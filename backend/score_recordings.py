@@ -0,0 +1,150 @@
+"""
+Offline bulk scoring of historical recordings.
+
+Runs trained patient models over many recording files, for example to
+audit a night of data or compare model versions. Each (recording, model)
+pair is parsed and windowed in vectorized form and classified in large
+batches, with the pairs spread across a process pool. For every pair a
+per-window timeline is written with the predicted activity, its
+confidence, and the simulated inactivity timer and warnings, using the
+same rules as the live hardware loop.
+
+Usage:
+    python score_recordings.py recordings/*.csv --models test patient1 --out scores
+"""
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+import torch
+
+from shared_config import ACTIVITIES, parse_recording, update_activity_seconds, warning_level
+from features import extract_features
+from motion_gate import MotionGate, gate_statistic, cascade_report
+from resample import resample
+from train_model import load_checkpoint, create_windows, scale_windows
+
+# --- Configuration ---
+BATCH_SIZE = 4096            # Windows per forward pass
+MAX_ACTIVITY_SECONDS = 300   # Matches the live default
+
+def simulate_alerts(activities, window_seconds, step_seconds, max_seconds=MAX_ACTIVITY_SECONDS):
+    # Replays the live inactivity timer over a sequence of predictions.
+    # Live, `elapsed` is the wall time between predictions: one window to fill the first, then one step each.
+    seconds = float(max_seconds)
+    trace_seconds, trace_warnings = [], []
+    for i, activity in enumerate(activities):
+        elapsed = window_seconds if i == 0 else step_seconds
+        seconds = update_activity_seconds(seconds, activity, elapsed, max_seconds)
+        trace_seconds.append(int(seconds))
+        trace_warnings.append(warning_level(seconds, max_seconds))
+    return trace_seconds, trace_warnings
+
+def score_recording(recording_path, patient_id, out_dir, max_seconds=MAX_ACTIVITY_SECONDS, cascade=False):
+    # Scores one recording with one patient's model and writes its timeline CSV (runs in a worker process).
+    # With cascade, the model's motion gate decides clear-cut windows as it would live; the CNN still
+    # scores every window so the report can say how often the two agree.
+    torch.set_num_threads(1)
+    model, config = load_checkpoint(f"{patient_id}_model.pth")
+    scaler = joblib.load(f"{patient_id}_scaler.joblib")
+    window_size, step_size = config['window_size'], config['step_size']
+
+    # Parsed here rather than with load_recording, to also count the samples as recorded (before resampling).
+    with open(recording_path, 'rb') as f:
+        segments = parse_recording(f.read())
+    num_samples = sum(len(samples) for _, samples in segments)
+    if segments:
+        raw = np.concatenate([resample(samples, rate, config['sample_rate']) for rate, samples in segments])
+    else:
+        raw = np.empty((0, 3), dtype=np.float32)
+    if len(raw) < 2:
+        return recording_path, patient_id, num_samples, None
+
+    features = extract_features(raw, config['features'])
+    X, _ = create_windows(features, np.zeros(len(features), dtype=np.int64), window_size, step_size)
+    X = torch.from_numpy(scale_windows(scaler, X)).permute(0, 2, 1)
+
+    probabilities = []
+    with torch.no_grad():
+        for start in range(0, len(X), BATCH_SIZE):
+            probabilities.append(torch.softmax(model(X[start:start + BATCH_SIZE]), dim=1))
+    probabilities = torch.cat(probabilities).numpy() if probabilities else np.empty((0, len(ACTIVITIES)))
+
+    predicted = probabilities.argmax(axis=1)
+    gated = np.zeros(len(predicted), dtype=bool)
+    cascade_summary = None
+    gate = MotionGate.from_dict(config.get('gate')) if cascade else None
+    if gate is not None:
+        raw_windows, _ = create_windows(raw, np.zeros(len(raw), dtype=np.int64), window_size, step_size)
+        stats = gate_statistic(raw_windows)
+        decisions = gate.decide(stats)
+        cascade_summary = cascade_report(gate, stats, predicted)
+        gated = decisions >= 0
+        predicted = np.where(gated, decisions, predicted)
+    activities = np.array(ACTIVITIES)[predicted]
+    end_samples = np.arange(len(X)) * step_size + window_size - 1
+    trace_seconds, trace_warnings = simulate_alerts(activities, config['window_seconds'], config['step_seconds'], max_seconds)
+
+    timeline = pd.DataFrame({
+        'window': np.arange(len(X)),
+        'end_sample': end_samples,  # At the model's sample rate
+        'time_s': (end_samples + 1) / config['sample_rate'],
+        'activity': activities,
+        'confidence': np.where(gated, 1.0, probabilities.max(axis=1).round(4)),
+        'gated': gated,
+        'activity_seconds': trace_seconds,
+        'warning': trace_warnings,
+    })
+    name = os.path.splitext(os.path.basename(recording_path))[0]
+    out_path = os.path.join(out_dir, f"{name}__{patient_id}.csv")
+    timeline.to_csv(out_path, index=False)
+
+    summary = {
+        'windows': len(timeline),
+        'still_fraction': float((predicted == ACTIVITIES.index('still')).mean()) if len(X) else 0.0,
+        # Count alerts as transitions into the "MOVE NOW!" state, as the LCD would show them.
+        'alerts': int(((timeline['warning'] == "MOVE NOW!") & (timeline['warning'].shift() != "MOVE NOW!")).sum()),
+        'output': out_path,
+        'cascade': cascade_summary,
+    }
+    return recording_path, patient_id, num_samples, summary
+
+# --- Command Line Entry Point ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score recordings offline with trained patient models.")
+    parser.add_argument('recordings', nargs='+', help="Recording files or glob patterns")
+    parser.add_argument('--models', nargs='+', default=['test'], help="Patient IDs whose models to run")
+    parser.add_argument('--out', default='scores', help="Output directory for the timelines")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--max-seconds', type=int, default=MAX_ACTIVITY_SECONDS, help="Inactivity limit for the alert simulation")
+    parser.add_argument('--cascade', action='store_true', help="Let the model's motion gate decide clear-cut windows, as live")
+    args = parser.parse_args()
+
+    recordings = sorted({path for pattern in args.recordings for path in (glob.glob(pattern) or [pattern])})
+    os.makedirs(args.out, exist_ok=True)
+
+    start = time.time()
+    recording_samples = {}  # Samples of each recording as recorded, counted once however many models score it
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(score_recording, path, patient_id, args.out, args.max_seconds, args.cascade)
+                   for path in recordings for patient_id in args.models]
+        for future in futures:
+            path, patient_id, num_samples, summary = future.result()
+            recording_samples[path] = num_samples
+            if summary is None:
+                print(f"{path} [{patient_id}]: no accelerometer data, skipped")
+            else:
+                print(f"{path} [{patient_id}]: {summary['windows']} windows, "
+                      f"{100 * summary['still_fraction']:.1f}% still, {summary['alerts']} alerts -> {summary['output']}")
+                if summary['cascade']:
+                    print(f"  motion gate decided {100 * summary['cascade']['gated_fraction']:.1f}% of windows, "
+                          f"{100 * summary['cascade']['agreement']:.1f}% agreement with the CNN")
+
+    elapsed = time.time() - start
+    total_samples = sum(recording_samples.values())
+    print(f"Scored {total_samples} samples in {elapsed:.1f}s ({60 * total_samples / max(elapsed, 1e-9):,.0f} samples/min)")
@@ -0,0 +1,175 @@
+"""
+Serial link to the wearable with fast reconnects.
+
+Finds the device by trying the configured port first, then any port whose
+USB VID/PID matches a known board. Retries with a short exponential
+backoff. A port is only considered connected once the firmware answers a
+command with an "ACK:" line, so there is no fixed start-up delay. The last
+LCD text and backlight colour are cached and replayed on reconnect. The
+LCD command doubles as the handshake probe, so the display is restored as
+part of the handshake.
+
+All I/O goes through an asyncio serial transport, so waiting for the device
+never blocks the event loop.
+"""
+import asyncio
+import time
+from collections import deque
+
+import serial
+import serial_asyncio
+from serial.tools import list_ports
+
+from shared_config import SERIAL_PORT, BAUD_RATE, SERIAL_USB_IDS
+
+# --- Reconnect Configuration ---
+BACKOFF_INITIAL = 0.05   # Seconds before the first retry
+BACKOFF_MAX = 1.0        # Longest wait between scans
+HANDSHAKE_TIMEOUT = 2.5  # Long enough for boards that reset when the port opens
+HANDSHAKE_RESEND = 0.25  # Resend the probe this often in case the board was still booting
+
+class SerialLink:
+    def __init__(self, preferred_port=SERIAL_PORT, baud_rate=BAUD_RATE):
+        self.preferred_port = preferred_port
+        self.baud_rate = baud_rate
+        self.reader = None
+        self.writer = None
+        self.port = None
+        self.display_cache = {}  # Last command of each display type, e.g. {'L': "L:...\n", 'RGB': "RGB:...\n"}
+        self.disconnected_at = None  # Set by mark_disconnected(); None until the link has been lost once
+        self.startup_connect_s = None
+        self.last_recovery_s = None
+        self.recovery_times = deque(maxlen=20)
+        self.connect_count = 0
+
+    @property
+    def is_open(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    # --- Port Discovery ---
+    def candidate_ports(self):
+        # The configured port first (and the last one that worked), then ports that look like our board.
+        candidates = [port for port in (self.port, self.preferred_port) if port]
+        try:
+            for info in list_ports.comports():
+                if any(info.vid == vid and (pid is None or info.pid == pid) for vid, pid in SERIAL_USB_IDS):
+                    candidates.append(info.device)
+        except Exception as e:
+            print(f"Error listing serial ports: {e}")
+        return list(dict.fromkeys(candidates))  # Remove duplicates, keep order
+
+    # --- Connection ---
+    async def connect(self):
+        # Scans the candidate ports until one completes the handshake. Returns the time taken in seconds:
+        # since the link was lost for a reconnect, since this call for the first connection.
+        started = time.perf_counter()
+        delay = BACKOFF_INITIAL
+        while True:
+            for port in self.candidate_ports():
+                if await self._try_port(port):
+                    return self._mark_connected(started)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BACKOFF_MAX)
+
+    async def _try_port(self, port):
+        try:
+            reader, writer = await serial_asyncio.open_serial_connection(
+                url=port,
+                baudrate=self.baud_rate,
+                dsrdtr=False,     # Disable Data Terminal (DTR) (prevents Arduino reset)
+                rtscts=False      # Disable Request to Send and Clear to Send (RTS/CTS) flow control
+            )
+        except (serial.SerialException, OSError):
+            return False
+
+        if await self._handshake(reader, writer):
+            self.reader, self.writer, self.port = reader, writer, port
+            return True
+        writer.close()
+        return False
+
+    async def _handshake(self, reader, writer):
+        # Sends the cached LCD command (or a greeting) and waits for the firmware's "ACK:" reply.
+        probe = self.display_cache.get('L', "L:Reconnecting...|\n")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + HANDSHAKE_TIMEOUT
+        next_send = 0.0
+        try:
+            while loop.time() < deadline:
+                if loop.time() >= next_send:
+                    writer.write(probe.encode('ascii'))
+                    next_send = loop.time() + HANDSHAKE_RESEND
+                try:
+                    # readline() only consumes a complete line, so a timeout never loses data.
+                    line = await asyncio.wait_for(reader.readline(), min(next_send, deadline) - loop.time())
+                except asyncio.TimeoutError:
+                    continue
+                if not line:
+                    return False  # Port closed
+                if line.decode('ascii', errors='ignore').strip().startswith("ACK:"):
+                    return True
+        except (serial.SerialException, OSError):
+            pass
+        return False
+
+    def _mark_connected(self, started):
+        # Only reconnects count as recoveries. The first connection includes start-up and waiting for the
+        # device to be plugged in, so it is reported separately.
+        now = time.perf_counter()
+        if self.disconnected_at is not None:
+            elapsed = now - self.disconnected_at
+            self.disconnected_at = None
+            self.last_recovery_s = elapsed
+            self.recovery_times.append(elapsed)
+        else:
+            elapsed = now - started
+            self.startup_connect_s = elapsed
+        self.connect_count += 1
+        print(f"Serial connection established on {self.port} in {elapsed * 1000:.0f} ms.")
+
+        # The LCD text was restored by the handshake; restore the backlight colour too.
+        if 'RGB' in self.display_cache:
+            self.write(self.display_cache['RGB'])
+        return elapsed
+
+    def mark_disconnected(self):
+        # Called when an I/O error shows the device is gone. Starts the recovery timer.
+        if self.writer:
+            try:
+                self.writer.close()
+            except Exception:
+                pass
+        self.reader = self.writer = None
+        if self.disconnected_at is None:
+            self.disconnected_at = time.perf_counter()
+
+    # --- I/O ---
+    async def readline(self):
+        # Waits for the next line from the device. Raises ConnectionError if the port was closed.
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Serial port closed")
+        return line
+
+    def write(self, command_str):
+        # Caches display commands and queues them on the transport if the link is up (never blocks).
+        # Returns the number of bytes queued.
+        command_type = command_str.split(':', 1)[0]
+        if command_type in ('L', 'RGB'):
+            self.display_cache[command_type] = command_str
+        if not self.is_open:
+            return 0
+        data = command_str.encode('ascii')
+        self.writer.write(data)
+        return len(data)
+
+    def status(self):
+        # Connection details for the dashboard.
+        return {
+            'connected': self.is_open,
+            'port': self.port,
+            'startupConnectMs': round(self.startup_connect_s * 1000) if self.startup_connect_s is not None else None,
+            'lastRecoveryMs': round(self.last_recovery_s * 1000) if self.last_recovery_s is not None else None,
+            'avgRecoveryMs': round(1000 * sum(self.recovery_times) / len(self.recovery_times)) if self.recovery_times else None,
+            'reconnects': max(0, self.connect_count - 1),
+        }
@@ -1,16 +1,57 @@
 """
 Shared configuration and utility functions for the Delirium Prevention project.
 """
+import os
+import re
+
+import numpy as np
+
 # --- Hardware Configuration ---
-SERIAL_PORT = 'COM7' # <-- CHECK THIS PORT
+# The SERIAL_PORT environment variable overrides this, e.g. "socket://127.0.0.1:7000" for the simulated device.
+SERIAL_PORT = os.environ.get('SERIAL_PORT', 'COM7') # <-- CHECK THIS PORT
 BAUD_RATE = 9600
+# The firmware sends one packet every 100 ms. This is the live input rate; the SAMPLE_RATE_HZ environment
+# variable overrides it for firmware (or a simulated device) that streams faster.
+SAMPLE_RATE_HZ = float(os.environ.get('SAMPLE_RATE_HZ', 10))
+# USB (vendor ID, product ID or None for any) of boards to try when SERIAL_PORT is unavailable
+SERIAL_USB_IDS = [
+    (0x2341, None),    # Arduino (incl. R4 Minima)
+    (0x2A03, None),    # Arduino.org
+    (0x1A86, 0x7523),  # CH340 USB-serial (common clones)
+    (0x0483, 0x374B),  # ST-LINK/V2-1 virtual COM port (Nucleo boards)
+]
+# Optional packet counter, e.g. "...,S:1336,N:42". Only the simulated device sends it. The backend echoes
+# it as 'sample' in the updates a packet triggers, so load tests can measure end-to-end latency.
+SEQUENCE_KEY = 'N'
 
 # --- ML Model Configuration ---
-WINDOW_SIZE = 20
-STEP_SIZE = 10
+# Windows are defined in seconds. Recordings and the live stream are resampled to the model's sample rate
+# before features and windows are computed, so a model doesn't depend on how fast the firmware sends.
+MODEL_SAMPLE_RATE_HZ = 10
+WINDOW_SECONDS = 2.0
+STEP_SECONDS = 1.0
+WINDOW_SIZE = round(WINDOW_SECONDS * MODEL_SAMPLE_RATE_HZ)  # In samples at MODEL_SAMPLE_RATE_HZ
+STEP_SIZE = round(STEP_SECONDS * MODEL_SAMPLE_RATE_HZ)
+# Rate of recordings without a "#RATE:" line, and the rate that window sizes in older checkpoints refer to
+LEGACY_SAMPLE_RATE_HZ = 10
 ACTIVITIES = ['still', 'active']  # Simplified to 2 classes
 NUM_CLASSES = len(ACTIVITIES)
 
+# --- Cascade Inference ---
+# A cheap per-patient motion gate decides clear-cut windows; only ambiguous ones run the CNN.
+CASCADE_ENABLED = True
+GATE_CONFIDENCE = 0.98  # Precision each gate threshold must reach on the training windows
+GATE_MIN_SUPPORT = 20   # Minimum training windows behind each threshold
+# A fitted gate is only kept if, on the validation windows, it agrees with the CNN at least this often
+# and costs at most GATE_ACCURACY_TOLERANCE of accuracy. Otherwise the model is stored without one.
+GATE_MIN_AGREEMENT = 0.98
+GATE_ACCURACY_TOLERANCE = 0.005
+
+# --- Inactivity Timer Rules ---
+ACTIVE_RECOVERY_RATE = 5  # Seconds regained per second of activity
+WARNING_1_FRACTION = 0.30
+WARNING_2_FRACTION = 0.10
+
 # --- Shared Utility Functions ---
 def parse_full_packet(line):
     """
@@ -31,4 +72,63 @@ def parse_full_packet(line):
         print(f"Error parsing packet part: {e}")
         pass
 
-    return data
\ No newline at end of file
+    return data
+
+# Matches the "#RATE:<hz>" line written at the start of each recording session.
+_RATE_PATTERN = re.compile(rb"^#RATE:([0-9.]+)[ \t]*\r?$", re.MULTILINE)
+
+# Matches the accelerometer fields of a packet, e.g. "X:2048,Y:2050,Z:2046".
+_XYZ_PATTERN = re.compile(rb"X:([-+0-9.eE]+),Y:([-+0-9.eE]+),Z:([-+0-9.eE]+)")
+
+def parse_xyz_block(data):
+    """
+    Parses many packets at once and returns their [X, Y, Z] values
+    as an (N, 3) float32 array. Lines without accelerometer data are
+    skipped, just like when parsing them one at a time.
+
+    `data` is the raw contents of a recording (bytes or str).
+    """
+    if isinstance(data, str):
+        data = data.encode('ascii', errors='ignore')
+    matches = _XYZ_PATTERN.findall(data)
+    if not matches:
+        return np.empty((0, 3), dtype=np.float32)
+    return np.array(matches, dtype=np.float64).astype(np.float32)
+
+def update_activity_seconds(activity_seconds, activity, elapsed, max_seconds):
+    """
+    Applies one step of the inactivity timer: time drains while the
+    patient is still and recovers ACTIVE_RECOVERY_RATE times faster
+    while they are active.
+    """
+    if activity == 'still':
+        return max(0, activity_seconds - elapsed)
+    return min(max_seconds, activity_seconds + (ACTIVE_RECOVERY_RATE * elapsed))
+
+def warning_level(activity_seconds, max_seconds):
+    """
+    Returns the warning text for the remaining activity time:
+    "MOVE NOW!" at 0%, "WARN2" at 10%, "WARN1" at 30%, otherwise "".
+    """
+    progress_percent = activity_seconds / max_seconds if max_seconds > 0 else 0
+    if activity_seconds <= 0:
+        return "MOVE NOW!"
+    if progress_percent <= WARNING_2_FRACTION:
+        return "WARN2"
+    if progress_percent <= WARNING_1_FRACTION:
+        return "WARN1"
+    return ""
+
+def parse_recording(data, default_rate=LEGACY_SAMPLE_RATE_HZ):
+    """
+    Splits the bytes of a recording into (sample_rate, samples) segments, one per
+    recording session. Each session starts with a "#RATE:<hz>" line; samples before
+    the first such line (recordings made before rates were written) are at default_rate.
+    Empty segments are left out.
+    """
+    if isinstance(data, str):
+        data = data.encode('ascii', errors='ignore')
+    parts = _RATE_PATTERN.split(data)
+    segments = [(default_rate, parse_xyz_block(parts[0]))]
+    segments += [(float(rate), parse_xyz_block(block)) for rate, block in zip(parts[1::2], parts[2::2])]
+    return [(rate, samples) for rate, samples in segments if len(samples)]
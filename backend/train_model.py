@@ -7,32 +7,73 @@ from torch.utils.data import DataLoader, TensorDataset
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 import joblib
+import copy
+import glob
+import hashlib
+import json
 import os
-from shared_config import WINDOW_SIZE, STEP_SIZE, ACTIVITIES, NUM_CLASSES, parse_full_packet
+import time
+from shared_config import (
+    WINDOW_SIZE, STEP_SIZE, WINDOW_SECONDS, STEP_SECONDS, MODEL_SAMPLE_RATE_HZ, LEGACY_SAMPLE_RATE_HZ,
+    ACTIVITIES, NUM_CLASSES, GATE_MIN_AGREEMENT, GATE_ACCURACY_TOLERANCE, parse_full_packet, parse_recording
+)
+from features import DEFAULT_FEATURES, extract_features, num_channels
+from resample import resample
+from motion_gate import MotionGate, gate_statistic, cascade_report
 
 # --- Global Configuration ---
 # Set the computation device to GPU (cuda) if available, otherwise use CPU.
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+# Default training settings. Any of these can be overridden per patient (see hparam_search.py),
+# and the values used are stored in the model checkpoint so the live loop can match them.
+DEFAULT_TRAINING_CONFIG = {
+    'window_seconds': WINDOW_SECONDS,
+    'step_seconds': STEP_SECONDS,
+    'sample_rate': MODEL_SAMPLE_RATE_HZ,  # All data is resampled to this rate before features and windows
+    'width': 64,
+    'lr': 0.001,
+    'num_epochs': 30,
+    'batch_size': 32,
+    'features': DEFAULT_FEATURES,  # Feature extractors (see features.py); their channel count is the model's input size
+}
+
+# --- Population Base Model ---
+# A base model pretrained on every stored recording, which new patients fine-tune from.
+BASE_MODEL_FILE = "base_model.pth"
+FINETUNE_EPOCHS = 5
+FINETUNE_LR = 0.001
+CONV_LR_SCALE = 0.1  # When the conv layers are not frozen, they train at this fraction of the learning rate
+
+# --- Incremental Updates ---
+INCREMENTAL_EPOCHS = 5
+INCREMENTAL_LR = 0.0005
+REPLAY_RATIO = 1.0  # Old windows replayed per new window, so the model doesn't forget earlier recordings
+HOLDOUT_FRACTION = 0.2       # Share of each recording's new windows held out to compare the updated and previous models
+MIN_VALIDATION_WINDOWS = 20  # An update needs at least this many held-out new windows to be checked (and applied)
+FORGETTING_TOLERANCE = 5.0   # Percentage points an update may lose on any activity's held-out old windows
+
 # --- 1. Model Architecture ---
 # This defines the structure of our Neural Network for Human Activity Recognition (HAR).
 # It's a 1D Convolutional Neural Network (CNN), which is effective for sequence data like time-series from sensors.
 class HARModel(nn.Module):
-    def __init__(self, num_classes):
+    def __init__(self, num_classes, width=64, in_channels=6):
         super(HARModel, self).__init__()
-        # The input has 6 channels: raw accelerometer data (X, Y, Z) and jerk (deltaX, deltaY, deltaZ).
-        # First convolutional layer: takes 6 channels, outputs 64 feature maps.
-        self.conv1 = nn.Conv1d(in_channels=6, out_channels=64, kernel_size=3, padding=1)
+        # `width` sets the number of feature maps; the second conv layer and first dense layer scale with it.
+        # By default the input has 6 channels: raw accelerometer data (X, Y, Z) and jerk (deltaX, deltaY, deltaZ).
+        # `in_channels` follows the feature extractors the model is trained with (see features.py).
+        # First convolutional layer: takes the input channels, outputs `width` (default 64) feature maps.
+        self.conv1 = nn.Conv1d(in_channels=in_channels, out_channels=width, kernel_size=3, padding=1)
         # Batch normalization stabilizes and speeds up training.
-        self.bn1 = nn.BatchNorm1d(64)
+        self.bn1 = nn.BatchNorm1d(width)
         # ReLU (Rectified Linear Unit) is a standard activation function.
         self.relu1 = nn.ReLU()
         # Max pooling reduces the dimensionality of the features.
         self.pool1 = nn.MaxPool1d(kernel_size=2)
 
-        # Second convolutional layer: increases feature depth from 64 to 128.
-        self.conv2 = nn.Conv1d(in_channels=64, out_channels=128, kernel_size=3, padding=1)
-        self.bn2 = nn.BatchNorm1d(128)
+        # Second convolutional layer: doubles the feature depth (64 to 128 by default).
+        self.conv2 = nn.Conv1d(in_channels=width, out_channels=2 * width, kernel_size=3, padding=1)
+        self.bn2 = nn.BatchNorm1d(2 * width)
         self.relu2 = nn.ReLU()
         self.pool2 = nn.MaxPool1d(kernel_size=2)
 
@@ -42,12 +83,12 @@ class HARModel(nn.Module):
         self.flatten = nn.Flatten()
 
         # Fully connected (Dense) layers for classification.
-        self.fc1 = nn.Linear(128, 64)
+        self.fc1 = nn.Linear(2 * width, width)
         self.relu3 = nn.ReLU()
         # Dropout is a regularization technique to prevent overfitting by randomly zeroing some neurons during training.
         self.dropout = nn.Dropout(0.3)
-        # The final output layer maps the 64 features to the number of activity classes.
-        self.fc2 = nn.Linear(64, num_classes)
+        # The final output layer maps the `width` features to the number of activity classes.
+        self.fc2 = nn.Linear(width, num_classes)
 
     # Defines the forward pass of the data through the network.
     def forward(self, x):
@@ -60,37 +101,61 @@ class HARModel(nn.Module):
         x = self.fc2(x)
         return x
 
-# --- 2. Feature Engineering ---
-def compute_motion_features(data):
-    # Computes jerk (the change in acceleration) to create richer features for the model.
-    # The model gets both the raw acceleration and its rate of change.
-    # Args: data (numpy array): Raw [X, Y, Z] accelerometer values.
-    # Returns: features (numpy array): [X, Y, Z, deltaX, deltaY, deltaZ] values.
-    
-    # Calculate the difference between consecutive sensor readings (jerk).
-    deltas = np.zeros_like(data)
-    deltas[1:] = np.diff(data, axis=0)
-    # Assume the first sample has the same jerk as the second.
-    deltas[0] = deltas[1]
-
-    # Combine the raw data and the computed jerks into a 6-channel array.
-    features = np.concatenate([data, deltas], axis=1)
-    return features
-
-# --- 3. Main Training Function ---
-def train_model(patient_id="test", status_callback=None):
-    # This function orchestrates the entire training process from loading data to saving the final model.
-    # status_callback is a function (like `print` or a socket emit) to send progress updates.
-    if status_callback is None:
-        status_callback = print
-
-    status_callback(f"Starting training for patient: {patient_id}")
-
-    all_data, all_labels = [], []
+# --- 2. Configs & Checkpoints ---
+def resolve_config(overrides=None):
+    # Merges overrides into DEFAULT_TRAINING_CONFIG and adds the window length and step in samples
+    # ('window_size', 'step_size') at the config's sample rate.
+    # Configs from before windows were set in seconds only have the sizes, counted in samples of the
+    # LEGACY_SAMPLE_RATE_HZ stream; those are converted, so older checkpoints keep the same windows.
+    overrides = dict(overrides or {})
+    if 'window_size' in overrides and 'window_seconds' not in overrides:
+        legacy_rate = overrides.setdefault('sample_rate', LEGACY_SAMPLE_RATE_HZ)
+        overrides['window_seconds'] = overrides['window_size'] / legacy_rate
+        overrides.setdefault('step_seconds', overrides.get('step_size', STEP_SIZE) / legacy_rate)
+    config = {**DEFAULT_TRAINING_CONFIG, **overrides}
+    config['window_size'] = max(2, round(config['window_seconds'] * config['sample_rate']))
+    config['step_size'] = max(1, round(config['step_seconds'] * config['sample_rate']))
+    return config
+
+def save_checkpoint(path, model, config):
+    # Saves the model weights together with the settings it was trained with,
+    # including the feature extractors and the input channel count they produce.
+    config = {**config, 'in_channels': num_channels(config['features'])}
+    torch.save({'state_dict': model.state_dict(), 'config': config}, path)
+
+def load_checkpoint(path):
+    # Loads a checkpoint saved by save_checkpoint and returns (model, config).
+    # Older checkpoints hold only a state_dict; those were trained with the default settings.
+    checkpoint = torch.load(path, map_location='cpu')
+    if isinstance(checkpoint, dict) and 'state_dict' in checkpoint:
+        state_dict = checkpoint['state_dict']
+        config = resolve_config(checkpoint.get('config'))
+    else:
+        state_dict = checkpoint
+        config = resolve_config({'window_size': WINDOW_SIZE, 'step_size': STEP_SIZE})
+
+    model = HARModel(num_classes=NUM_CLASSES, width=config['width'], in_channels=num_channels(config['features']))
+    model.load_state_dict(state_dict)
+    model.eval()
+    return model, config
+
+# --- 3. Data Loading & Windowing ---
+def load_recording(filename, sample_rate=MODEL_SAMPLE_RATE_HZ):
+    # Parses a recording CSV and returns its raw [X, Y, Z] samples resampled to sample_rate, as a float32 array.
+    # Each recording session is resampled from the rate it was recorded at.
+    with open(filename, 'rb') as f:
+        segments = parse_recording(f.read())
+    if not segments:
+        return np.empty((0, 3), dtype=np.float32)
+    return np.concatenate([resample(samples, rate, sample_rate) for rate, samples in segments])
+
+def load_patient_data(patient_id, status_callback=print, feature_names=DEFAULT_FEATURES, sample_rate=MODEL_SAMPLE_RATE_HZ):
+    # Loads every activity recording for a patient at sample_rate and computes its features.
+    # Returns: (features, labels, raw) as numpy arrays, or (None, None, None) if no data was found.
+    all_features, all_labels, all_raw = [], [], []
     # Create a mapping from activity name (e.g., 'still') to a numeric label (e.g., 0).
     activity_map = {name: i for i, name in enumerate(ACTIVITIES)}
 
-    # --- Data Loading ---
     # Loop through each activity type to load its corresponding CSV file.
     for activity_name in ACTIVITIES:
         filename = f"{patient_id}_{activity_name}.csv"
@@ -98,89 +163,92 @@ def train_model(patient_id="test", status_callback=None):
             status_callback(f"Warning: File not found, skipping: {filename}")
             continue
 
-        activity_label = activity_map[activity_name]
         status_callback(f"Loading '{filename}'...")
-
-        # Parse each line of the CSV to extract sensor data.
-        temp_data = []
-        with open(filename, 'r') as f:
-            for line in f:
-                parsed_dict = parse_full_packet(line)
-                if parsed_dict and 'X' in parsed_dict:
-                    temp_data.append([parsed_dict['X'], parsed_dict['Y'], parsed_dict['Z']])
-
-        if temp_data:
-            # --- Feature Computation ---
-            # Convert list to numpy array and compute motion features.
-            temp_data_np = np.array(temp_data, dtype=np.float32)
-            temp_features = compute_motion_features(temp_data_np)
-
-            # Add the processed data and corresponding labels to our main lists.
-            for features in temp_features:
-                all_data.append(features)
-                all_labels.append(activity_label)
+        temp_data = load_recording(filename, sample_rate)
+
+        if len(temp_data) > 1:
+            # Compute motion features for the whole recording.
+            temp_features = extract_features(temp_data, feature_names)
+            all_features.append(temp_features)
+            all_raw.append(temp_data)
+            all_labels.append(np.full(len(temp_features), activity_map[activity_name], dtype=np.int64))
             status_callback(f"  -> Loaded {len(temp_data)} samples with motion features")
 
-    if not all_data:
-        status_callback(f"Error: No data found for patient '{patient_id}'. Training aborted.")
-        return False
-
-    # --- Windowing ---
-    # Create overlapping windows of data, which will be the inputs to the CNN.
-    status_callback(f"Total samples loaded: {len(all_data)}. Creating sliding windows...")
-    X, y = [], []
-    for i in range(0, len(all_data) - WINDOW_SIZE, STEP_SIZE):
-        window = all_data[i : i + WINDOW_SIZE]
-        label = all_labels[i + WINDOW_SIZE - 1] # Label for the window is the activity at the end of it.
-        X.append(window)
-        y.append(label)
-
-    X = np.array(X, dtype=np.float32)
-    y = np.array(y, dtype=np.int64)
-    status_callback(f"Created {len(X)} windows of size {WINDOW_SIZE}")
-
-    # --- Data Scaling ---
-    # Normalize the data to have a mean of 0 and a standard deviation of 1. This is crucial for training.
-    status_callback("Normalizing data and saving scaler...")
-    scaler = StandardScaler()
-    # Reshape data to 2D to fit the scaler, which works on a sample-by-feature basis.
-    X_flat = X.reshape(-1, 6) # 6 features: X, Y, Z, dX, dY, dZ
-    X_flat_scaled = scaler.fit_transform(X_flat)
-    # Reshape back to the original 3D window format.
-    X_scaled = X_flat_scaled.reshape(X.shape)
-
-    # Save the fitted scaler. This is important so we can apply the exact same normalization to live data.
-    scaler_filename = f"{patient_id}_scaler.joblib"
-    joblib.dump(scaler, scaler_filename)
-    status_callback(f"Scaler saved: {scaler_filename}")
+    if not all_features:
+        return None, None, None
+    return np.concatenate(all_features), np.concatenate(all_labels), np.concatenate(all_raw)
 
-    # --- Data Splitting & DataLoader Creation ---
-    # Split the dataset into training and validation sets. Stratify ensures both sets have a similar class distribution.
-    X_train, X_val, y_train, y_val = train_test_split(
-        X_scaled, y, test_size=0.2, random_state=42, stratify=y
-    )
-    status_callback(f"Training samples: {len(X_train)}, Validation samples: {len(X_val)}")
-
-    # Create PyTorch TensorDatasets. Note the permutation to match Conv1d's expected input shape: (batch, channels, length).
-    train_tensor = TensorDataset(torch.from_numpy(X_train).permute(0, 2, 1), torch.from_numpy(y_train))
-    val_tensor = TensorDataset(torch.from_numpy(X_val).permute(0, 2, 1), torch.from_numpy(y_val))
-
-    # Create DataLoaders to efficiently feed data to the model in batches.
-    train_loader = DataLoader(train_tensor, batch_size=32, shuffle=True)
-    val_loader = DataLoader(val_tensor, batch_size=32, shuffle=False)
-
-    # --- Model Initialization and Training ---
-    model = HARModel(num_classes=NUM_CLASSES).to(DEVICE)
+def recording_fingerprints(patient_id):
+    # Size and SHA-1 of each activity recording, stored in checkpoints next to the sample counts.
+    # A later update can then tell a recording that was added to (it still begins with the same bytes)
+    # from one that was recorded over.
+    fingerprints = {}
+    for activity_name in ACTIVITIES:
+        filename = f"{patient_id}_{activity_name}.csv"
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                data = f.read()
+            fingerprints[activity_name] = {'bytes': len(data), 'sha1': hashlib.sha1(data).hexdigest()}
+    return fingerprints
+
+def recording_extends(filename, fingerprint):
+    # True if the recording still begins with the data its fingerprint was taken of.
+    with open(filename, 'rb') as f:
+        data = f.read(fingerprint['bytes'])
+    return len(data) == fingerprint['bytes'] and hashlib.sha1(data).hexdigest() == fingerprint['sha1']
+
+def count_samples(labels):
+    # Number of samples per activity, stored in checkpoints so later updates know which data is new.
+    counts = np.bincount(labels, minlength=NUM_CLASSES)
+    return {activity: int(counts[i]) for i, activity in enumerate(ACTIVITIES)}
+
+def create_windows(features, labels, window_size, step_size):
+    # Creates overlapping windows of data, which will be the inputs to the CNN.
+    # The label for each window is the activity at the end of it.
+    num_windows = len(range(0, len(features) - window_size, step_size))
+    if num_windows <= 0:
+        return np.empty((0, window_size, features.shape[1]), dtype=np.float32), np.empty(0, dtype=np.int64)
+
+    # sliding_window_view returns (num_positions, channels, window); move the window axis before channels.
+    windows = np.lib.stride_tricks.sliding_window_view(features, window_size, axis=0)
+    X = windows[0 : num_windows * step_size : step_size].transpose(0, 2, 1)
+    y = labels[window_size - 1 : window_size - 1 + num_windows * step_size : step_size]
+    return np.ascontiguousarray(X, dtype=np.float32), y.astype(np.int64)
+
+def scale_windows(scaler, X):
+    # Applies a per-channel scaler to 3D windows by flattening them to (samples, channels).
+    return scaler.transform(X.reshape(-1, X.shape[2])).reshape(X.shape).astype(np.float32)
+
+def make_loader(X, y, batch_size=32, shuffle=False):
+    # Note the permutation to match Conv1d's expected input shape: (batch, channels, length).
+    dataset = TensorDataset(torch.from_numpy(X).permute(0, 2, 1), torch.from_numpy(y))
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle)
+
+# --- 4. Training Loop ---
+def evaluate(model, loader):
+    # Returns the accuracy (%) of the model on a DataLoader.
+    model.eval() # Set the model to evaluation mode (disables dropout).
+    correct, total = 0, 0
+    with torch.no_grad(): # Disable gradient calculation for efficiency.
+        for inputs, labels in loader:
+            inputs, labels = inputs.to(DEVICE), labels.to(DEVICE)
+            outputs = model(inputs)
+            _, predicted = torch.max(outputs.data, 1)
+            total += labels.size(0)
+            correct += (predicted == labels).sum().item()
+    return 100 * correct / total if total else 0.0
+
+def fit_model(model, train_loader, val_loader, lr, num_epochs, status_callback=None, param_groups=None):
+    # Trains the model and returns the best validation accuracy reached.
+    # param_groups optionally gives per-layer learning rates (see fine_tune_model).
     # CrossEntropyLoss is standard for multi-class classification.
     criterion = nn.CrossEntropyLoss()
     # Adam is a popular and effective optimization algorithm.
-    optimizer = optim.Adam(model.parameters(), lr=0.001)
+    optimizer = optim.Adam(param_groups or model.parameters(), lr=lr)
     # Reduce learning rate on a plateau to fine-tune the model when learning slows down.
     scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='max', factor=0.5, patience=3)
-    num_epochs = 30
     best_acc = 0.0
 
-    status_callback(f"Starting model training on {DEVICE} for {num_epochs} epochs...")
     for epoch in range(num_epochs):
         # --- Training Phase ---
         model.train() # Set the model to training mode (enables dropout).
@@ -193,32 +261,122 @@ def train_model(patient_id="test", status_callback=None):
             optimizer.step()         # Update model weights.
 
         # --- Validation Phase ---
-        model.eval() # Set the model to evaluation mode (disables dropout).
-        correct, total = 0, 0
-        with torch.no_grad(): # Disable gradient calculation for efficiency.
-            for inputs, labels in val_loader:
-                inputs, labels = inputs.to(DEVICE), labels.to(DEVICE)
-                outputs = model(inputs)
-                _, predicted = torch.max(outputs.data, 1)
-                total += labels.size(0)
-                correct += (predicted == labels).sum().item()
-
-        acc = 100 * correct / total
+        acc = evaluate(model, val_loader)
         scheduler.step(acc) # Update learning rate based on validation accuracy.
 
         if acc > best_acc:
             best_acc = acc
-            status_callback(f"Epoch {epoch+1}/{num_epochs} - Val Acc: {acc:.2f}% (NEW BEST)")
-        else:
+            if status_callback:
+                status_callback(f"Epoch {epoch+1}/{num_epochs} - Val Acc: {acc:.2f}% (NEW BEST)")
+        elif status_callback:
             status_callback(f"Epoch {epoch+1}/{num_epochs} - Val Acc: {acc:.2f}%")
 
+    return best_acc
+
+# --- 5. Main Training Function ---
+def prepare_patient_data(patient_id, config, status_callback=print):
+    # Loads, windows, scales and splits a patient's recordings.
+    # Returns a dict with the fitted scaler, the train/validation windows and labels, each window's
+    # motion-gate statistic, the per-activity sample counts and the recordings' fingerprints,
+    # or None if the patient has no data.
+    window_size, step_size = config['window_size'], config['step_size']
+
+    # --- Data Loading ---
+    fingerprints = recording_fingerprints(patient_id)
+    all_data, all_labels, all_raw = load_patient_data(patient_id, status_callback, config['features'], config['sample_rate'])
+    if all_data is None:
+        return None
+
+    # --- Windowing ---
+    status_callback(f"Total samples loaded: {len(all_data)}. Creating sliding windows...")
+    X, y = create_windows(all_data, all_labels, window_size, step_size)
+    raw_windows, _ = create_windows(all_raw, all_labels, window_size, step_size)
+    gate_stats = gate_statistic(raw_windows)
+    status_callback(f"Created {len(X)} windows of {config['window_seconds']:g}s "
+                    f"({window_size} samples at {config['sample_rate']:g} Hz)")
+
+    # --- Data Scaling ---
+    # Normalize the data to have a mean of 0 and a standard deviation of 1. This is crucial for training.
+    status_callback("Normalizing data...")
+    scaler = StandardScaler()
+    # Reshape data to 2D to fit the scaler, which works on a sample-by-feature basis.
+    scaler.fit(X.reshape(-1, X.shape[2])) # One column per feature channel
+    X_scaled = scale_windows(scaler, X)
+
+    # --- Data Splitting ---
+    # Split the dataset into training and validation sets. Stratify ensures both sets have a similar class distribution.
+    X_train, X_val, y_train, y_val, gate_train, gate_val = train_test_split(
+        X_scaled, y, gate_stats, test_size=0.2, random_state=42, stratify=y
+    )
+    status_callback(f"Training samples: {len(X_train)}, Validation samples: {len(X_val)}")
+    return {
+        'scaler': scaler,
+        'X_train': X_train, 'X_val': X_val,
+        'y_train': y_train, 'y_val': y_val,
+        'gate_train': gate_train, 'gate_val': gate_val,
+        'sample_counts': count_samples(all_labels),
+        'recordings': fingerprints,
+    }
+
+def saved_config(patient_id):
+    # The training settings chosen for a patient: those of its current model, or else the best configuration
+    # of a saved hyperparameter search (see hparam_search.py). Returns None if there are neither.
+    model_filename = f"{patient_id}_model.pth"
+    if os.path.exists(model_filename):
+        _, config = load_checkpoint(model_filename)
+        return {key: config[key] for key in DEFAULT_TRAINING_CONFIG}
+    search_filename = f"{patient_id}_search.json"
+    if os.path.exists(search_filename):
+        with open(search_filename) as f:
+            return json.load(f)['best']
+    return None
+
+def train_model(patient_id="test", status_callback=None, config=None):
+    # This function orchestrates the entire training process from loading data to saving the final model.
+    # status_callback is a function (like `print` or a socket emit) to send progress updates.
+    # config optionally overrides entries of DEFAULT_TRAINING_CONFIG (e.g. the result of a hyperparameter search).
+    # Without one, a retrain keeps the settings chosen for the patient (see saved_config).
+    if status_callback is None:
+        status_callback = print
+    if config is None:
+        config = saved_config(patient_id)
+    config = resolve_config(config)
+
+    status_callback(f"Starting training for patient: {patient_id}")
+
+    data = prepare_patient_data(patient_id, config, status_callback)
+    if data is None:
+        status_callback(f"Error: No data found for patient '{patient_id}'. Training aborted.")
+        return False
+
+    # Save the fitted scaler. This is important so we can apply the exact same normalization to live data.
+    scaler_filename = f"{patient_id}_scaler.joblib"
+    joblib.dump(data['scaler'], scaler_filename)
+    status_callback(f"Scaler saved: {scaler_filename}")
+
+    # Create DataLoaders to efficiently feed data to the model in batches.
+    train_loader = make_loader(data['X_train'], data['y_train'], config['batch_size'], shuffle=True)
+    val_loader = make_loader(data['X_val'], data['y_val'], config['batch_size'])
+
+    # --- Model Initialization and Training ---
+    model = HARModel(num_classes=NUM_CLASSES, width=config['width'], in_channels=num_channels(config['features'])).to(DEVICE)
+    status_callback(f"Starting model training on {DEVICE} for {config['num_epochs']} epochs...")
+    best_acc = fit_model(model, train_loader, val_loader, config['lr'], config['num_epochs'], status_callback)
     status_callback(f"Best validation accuracy: {best_acc:.2f}%")
 
+    # --- Motion Gate ---
+    gate = fit_gate(model, data, status_callback)
+
     # --- Save the Final Model ---
     model_filename = f"{patient_id}_model.pth"
-    torch.save(model.state_dict(), model_filename)
+    save_checkpoint(model_filename, model, {**config, 'sample_counts': data['sample_counts'], 'recordings': data['recordings'],
+                                            'gate': gate.to_dict() if gate else None})
     status_callback(f"Training complete. Model saved: {model_filename}")
 
+    report_class_accuracy(model, val_loader, status_callback)
+    return True
+
+def report_class_accuracy(model, val_loader, status_callback=print):
     # --- Final Evaluation ---
     # Provide a per-class breakdown of the model's performance on the validation set.
     status_callback("\nFinal Model Evaluation (on validation data):")
@@ -240,9 +398,294 @@ def train_model(patient_id="test", status_callback=None):
             acc = 100 * class_correct[i] / class_total[i]
             status_callback(f"  - {activity}: {acc:.1f}% accuracy")
 
+def predict(model, X):
+    # Returns the CNN's predicted label for each (already scaled) window.
+    model.eval()
+    with torch.no_grad():
+        outputs = model(torch.from_numpy(X).permute(0, 2, 1).to(DEVICE))
+    return outputs.argmax(dim=1).cpu().numpy()
+
+def fit_gate(model, data, status_callback=print):
+    # Fits the cascade's motion gate on the training windows and reports how it does on validation:
+    # the fraction of windows it decides and how often those decisions agree with the CNN.
+    # Returns the gate, or None if it would make the model less accurate (the model then always runs the CNN).
+    gate = MotionGate.fit(data['gate_train'], data['y_train'])
+    thresholds = f"still <= {gate.low:.1f}, active >= {gate.high:.1f}"
+    if len(data['y_val']) == 0:
+        status_callback(f"Motion gate ({thresholds}) turned off: no validation windows to check it on")
+        return None
+    report = cascade_report(gate, data['gate_val'], predict(model, data['X_val']), data['y_val'])
+    status_callback(f"Motion gate: {thresholds} - "
+                    f"decides {100 * report['gated_fraction']:.1f}% of windows, "
+                    f"{100 * report['agreement']:.1f}% agreement with the CNN "
+                    f"(cascade acc {100 * report['cascade_accuracy']:.1f}% vs CNN {100 * report['cnn_accuracy']:.1f}%)")
+    if (report['agreement'] < GATE_MIN_AGREEMENT
+            or report['cascade_accuracy'] < report['cnn_accuracy'] - GATE_ACCURACY_TOLERANCE):
+        status_callback(f"Motion gate turned off: it must agree with the CNN on {100 * GATE_MIN_AGREEMENT:.0f}% of windows "
+                        f"and cost at most {100 * GATE_ACCURACY_TOLERANCE:.1f} points of accuracy")
+        return None
+    return gate
+
+# --- 6. Population Base Model & Fine-Tuning ---
+def find_patients():
+    # Returns the IDs of every patient with at least one recording in the working directory.
+    patient_ids = set()
+    for activity_name in ACTIVITIES:
+        for filename in glob.glob(f"*_{activity_name}.csv"):
+            patient_ids.add(os.path.basename(filename)[:-len(f"_{activity_name}.csv")])
+    return sorted(patient_ids)
+
+def pretrain_base_model(patient_ids=None, status_callback=None, config=None):
+    # Trains a shared base model on all stored recordings.
+    # Each patient's data is normalized with its own scaler, exactly as it will be when fine-tuning,
+    # so the base model learns from inputs on the same scale the patient models see.
+    if status_callback is None:
+        status_callback = print
+    config = resolve_config(config)
+    patient_ids = patient_ids or find_patients()
+    status_callback(f"Pretraining base model on patients: {', '.join(patient_ids)}")
+
+    splits = []
+    for patient_id in patient_ids:
+        data = prepare_patient_data(patient_id, config, status_callback)
+        if data is not None:
+            splits.append((data['X_train'], data['X_val'], data['y_train'], data['y_val']))
+    if not splits:
+        status_callback("Error: No recordings found. Base model pretraining aborted.")
+        return False
+
+    X_train, X_val, y_train, y_val = (np.concatenate(parts) for parts in zip(*splits))
+    train_loader = make_loader(X_train, y_train, config['batch_size'], shuffle=True)
+    val_loader = make_loader(X_val, y_val, config['batch_size'])
+
+    model = HARModel(num_classes=NUM_CLASSES, width=config['width'], in_channels=num_channels(config['features'])).to(DEVICE)
+    status_callback(f"Starting base model training on {DEVICE} for {config['num_epochs']} epochs...")
+    best_acc = fit_model(model, train_loader, val_loader, config['lr'], config['num_epochs'], status_callback)
+
+    save_checkpoint(BASE_MODEL_FILE, model, {**config, 'patients': list(patient_ids)})
+    status_callback(f"Base model saved: {BASE_MODEL_FILE} (Val Acc: {best_acc:.2f}%)")
+    return True
+
+def fine_tune_model(patient_id="test", status_callback=None, freeze_conv=True, num_epochs=FINETUNE_EPOCHS, compare=False):
+    # Fine-tunes the base model on one patient's recordings.
+    # With freeze_conv the conv layers are fixed and only the dense layers (and batch-norm statistics) adapt;
+    # otherwise the conv layers train at CONV_LR_SCALE times the learning rate.
+    # With compare, a model is also trained from scratch on the same split to report time and accuracy side by side.
+    if status_callback is None:
+        status_callback = print
+    if not os.path.exists(BASE_MODEL_FILE):
+        status_callback(f"Error: Base model '{BASE_MODEL_FILE}' not found. Run pretraining first.")
+        return False
+
+    base_model, base_config = load_checkpoint(BASE_MODEL_FILE)
+    config = resolve_config({key: base_config[key] for key in DEFAULT_TRAINING_CONFIG})
+    status_callback(f"Starting fine-tuning for patient: {patient_id}")
+
+    data = prepare_patient_data(patient_id, config, status_callback)
+    if data is None:
+        status_callback(f"Error: No data found for patient '{patient_id}'. Fine-tuning aborted.")
+        return False
+    train_loader = make_loader(data['X_train'], data['y_train'], config['batch_size'], shuffle=True)
+    val_loader = make_loader(data['X_val'], data['y_val'], config['batch_size'])
+
+    model = base_model.to(DEVICE)
+    conv_params = [p for name, p in model.named_parameters() if name.startswith(('conv', 'bn'))]
+    head_params = [p for name, p in model.named_parameters() if not name.startswith(('conv', 'bn'))]
+    if freeze_conv:
+        for param in conv_params:
+            param.requires_grad = False
+        param_groups = [{'params': head_params}]
+    else:
+        param_groups = [{'params': head_params}, {'params': conv_params, 'lr': FINETUNE_LR * CONV_LR_SCALE}]
+
+    start = time.time()
+    status_callback(f"Fine-tuning on {DEVICE} for {num_epochs} epochs (conv layers {'frozen' if freeze_conv else 'at reduced LR'})...")
+    best_acc = fit_model(model, train_loader, val_loader, FINETUNE_LR, num_epochs, status_callback, param_groups)
+    finetune_time = time.time() - start
+    status_callback(f"Fine-tuned in {finetune_time:.1f}s - Val Acc: {best_acc:.2f}%")
+
+    for param in conv_params:
+        param.requires_grad = True
+
+    gate = fit_gate(model, data, status_callback)
+
+    scaler_filename = f"{patient_id}_scaler.joblib"
+    joblib.dump(data['scaler'], scaler_filename)
+    model_filename = f"{patient_id}_model.pth"
+    save_checkpoint(model_filename, model, {**config, 'base_model': BASE_MODEL_FILE,
+                                            'sample_counts': data['sample_counts'], 'recordings': data['recordings'],
+                                            'gate': gate.to_dict() if gate else None})
+    status_callback(f"Fine-tuning complete. Model saved: {model_filename}")
+
+    if compare:
+        start = time.time()
+        scratch_model = HARModel(num_classes=NUM_CLASSES, width=config['width'], in_channels=num_channels(config['features'])).to(DEVICE)
+        scratch_acc = fit_model(scratch_model, train_loader, val_loader, config['lr'], config['num_epochs'])
+        scratch_time = time.time() - start
+        status_callback(f"From scratch: {scratch_time:.1f}s, Val Acc: {scratch_acc:.2f}% | "
+                        f"Fine-tuned: {finetune_time:.1f}s, Val Acc: {best_acc:.2f}%")
+
+    report_class_accuracy(model, val_loader, status_callback)
+    return True
+
+# --- 7. Incremental Updates ---
+def update_model(patient_id="test", status_callback=None):
+    # Continues training the patient's existing model on data recorded since it was last trained.
+    # The scaler's running statistics are updated with the new windows (StandardScaler.partial_fit),
+    # the model trains on the new windows mixed with a replay sample of old ones, and the result only
+    # replaces the current model if it is at least as accurate on new windows neither model trained on
+    # and hasn't forgotten any activity in the older recordings.
+    if status_callback is None:
+        status_callback = print
+    model_filename = f"{patient_id}_model.pth"
+    scaler_filename = f"{patient_id}_scaler.joblib"
+    if not os.path.exists(model_filename) or not os.path.exists(scaler_filename):
+        status_callback(f"No existing model for '{patient_id}'. Running full training.")
+        return train_model(patient_id, status_callback)
+
+    previous_model, config = load_checkpoint(model_filename)
+    previous_counts = config.get('sample_counts')
+    previous_recordings = config.get('recordings', {})  # Missing in checkpoints from before recordings could be recorded over
+    if previous_counts is None:
+        status_callback("Existing model has no record of its training data. Running full training.")
+        return train_model(patient_id, status_callback, {key: config[key] for key in DEFAULT_TRAINING_CONFIG})
+    previous_scaler = joblib.load(scaler_filename)
+    status_callback(f"Starting incremental update for patient: {patient_id}")
+
+    # --- Split each recording into already-seen and new windows ---
+    window_size, step_size = config['window_size'], config['step_size']
+    recordings = []
+    sample_counts = {}
+    fingerprints = recording_fingerprints(patient_id)
+    for label, activity_name in enumerate(ACTIVITIES):
+        filename = f"{patient_id}_{activity_name}.csv"
+        raw = load_recording(filename, config['sample_rate']) if os.path.exists(filename) else np.empty((0, 3), dtype=np.float32)
+        sample_counts[activity_name] = len(raw)
+        if len(raw) < 2:
+            continue
+        seen = previous_counts.get(activity_name, 0)
+        fingerprint = previous_recordings.get(activity_name)
+        if seen > len(raw) or (fingerprint and not recording_extends(filename, fingerprint)):
+            seen = 0  # The recording was recorded over, so all of it is new
+        features = extract_features(raw, config['features'])
+        X, y = create_windows(features, np.full(len(features), label, dtype=np.int64), window_size, step_size)
+        raw_windows, _ = create_windows(raw, np.zeros(len(raw), dtype=np.int64), window_size, step_size)
+        # A window is new if it ends on a sample the previous model has not seen.
+        is_new = np.arange(len(X)) * step_size + window_size - 1 >= seen
+        recordings.append((X, y, gate_statistic(raw_windows), is_new))
+        status_callback(f"  -> {activity_name}: {len(raw) - seen} new samples, {is_new.sum()} new windows")
+
+    num_new = sum(int(is_new.sum()) for *_, is_new in recordings)
+    if num_new == 0:
+        status_callback("No new data since the last training. Incremental update complete (model unchanged).")
+        return True
+
+    # --- Held-out Windows ---
+    # The newest windows of each recording are held out. The previous model has never seen them and the update
+    # doesn't train on them, so they compare the two fairly. Windows overlapping them are left out of training.
+    # Until there is enough new data to check an update on, the previous model stays; the new data keeps
+    # counting as new, so a later update will include it.
+    held_out = [int(is_new.sum() * HOLDOUT_FRACTION) for *_, is_new in recordings]
+    if sum(held_out) < MIN_VALIDATION_WINDOWS:
+        status_callback(f"{num_new} new windows are too few to hold out {MIN_VALIDATION_WINDOWS} for checking an update. "
+                        f"Record more data first. Incremental update complete (model unchanged).")
+        return True
+    gap = -(-window_size // step_size)  # Windows fewer than this many steps apart overlap
+    # The oldest windows of each recording are held out from the replay too. The previous model trained on most
+    # of them, so they can't show which model is better, but an update that forgot an activity does worse on them.
+    new_parts, old_parts, val_parts, old_val_parts = [], [], [], []
+    for (X, y, stats, is_new), num_val in zip(recordings, held_out):
+        train = np.ones(len(X), dtype=bool)
+        if num_val:
+            train[len(X) - num_val - gap + 1:] = False
+        num_old_val = int((~is_new).sum() * HOLDOUT_FRACTION)
+        if num_old_val:
+            train[:num_old_val + gap - 1] = False
+            old_val_parts.append((X[:num_old_val], y[:num_old_val]))
+        val_parts.append((X[len(X) - num_val:], y[len(X) - num_val:], stats[len(X) - num_val:]))
+        new_parts.append((X[train & is_new], y[train & is_new], stats[train & is_new]))
+        old_parts.append((X[train & ~is_new], y[train & ~is_new], stats[train & ~is_new]))
+    X_new, y_new, stats_new = (np.concatenate(part) for part in zip(*new_parts))
+    X_old, y_old, stats_old = (np.concatenate(part) for part in zip(*old_parts))
+    X_val, y_val, gate_val = (np.concatenate(part) for part in zip(*val_parts))
+    X_old_val, y_old_val = (np.concatenate(part) for part in zip(*old_val_parts)) if old_val_parts else (X_val[:0], y_val[:0])
+
+    # --- Replay Sample ---
+    rng = np.random.default_rng(42)
+    num_replay = min(len(X_old), int(len(X_new) * REPLAY_RATIO))
+    replay_idx = rng.choice(len(X_old), num_replay, replace=False)
+    X_train = np.concatenate([X_new, X_old[replay_idx]])
+    y_train = np.concatenate([y_new, y_old[replay_idx]])
+    gate_train = np.concatenate([stats_new, stats_old[replay_idx]])
+    status_callback(f"Training on {len(X_new)} new windows + {num_replay} replayed windows, "
+                    f"validating on {len(X_val)} held-out new and {len(X_old_val)} held-out old windows")
+
+    # --- Scaler Update (running moments) ---
+    # The scaler was fit on windowed rows, where overlapping windows count each sample several times.
+    # New data is added the same way, so it gets the same weight as the data already seen.
+    scaler = copy.deepcopy(previous_scaler)
+    all_new = np.concatenate([X[is_new] for X, _, _, is_new in recordings])
+    scaler.partial_fit(all_new.reshape(-1, all_new.shape[2]))
+
+    # --- Train & Compare ---
+    X_train = scale_windows(scaler, X_train)
+    X_val_scaled = scale_windows(scaler, X_val)
+    train_loader = make_loader(X_train, y_train, config['batch_size'], shuffle=True)
+    val_loader = make_loader(X_val_scaled, y_val, config['batch_size'])
+
+    model = copy.deepcopy(previous_model).to(DEVICE)
+    start = time.time()
+    fit_model(model, train_loader, val_loader, INCREMENTAL_LR, INCREMENTAL_EPOCHS, status_callback)
+    updated_acc = evaluate(model, val_loader)
+    previous_acc = evaluate(previous_model.to(DEVICE), make_loader(scale_windows(previous_scaler, X_val), y_val, config['batch_size']))
+    status_callback(f"Updated in {time.time() - start:.1f}s - Val Acc: {updated_acc:.2f}% (previous model: {previous_acc:.2f}%)")
+
+    if updated_acc < previous_acc:
+        status_callback("Updated model is less accurate. Incremental update complete (previous model kept).")
+        return True
+
+    # --- Forgetting Check (per activity, on old data) ---
+    if len(X_old_val):
+        updated_pred = predict(model, scale_windows(scaler, X_old_val))
+        previous_pred = predict(previous_model, scale_windows(previous_scaler, X_old_val))
+        for label in np.unique(y_old_val):
+            mask = y_old_val == label
+            updated_class_acc = 100 * (updated_pred[mask] == label).mean()
+            previous_class_acc = 100 * (previous_pred[mask] == label).mean()
+            status_callback(f"  - {ACTIVITIES[label]} (old data): {updated_class_acc:.1f}% (previous model: {previous_class_acc:.1f}%)")
+            if updated_class_acc < previous_class_acc - FORGETTING_TOLERANCE:
+                status_callback(f"Updated model has forgotten '{ACTIVITIES[label]}'. Incremental update complete (previous model kept).")
+                return True
+
+    # Refit the gate on this update's windows so it follows the patient's latest data.
+    gate = fit_gate(model, {'gate_train': gate_train, 'y_train': y_train, 'gate_val': gate_val,
+                            'y_val': y_val, 'X_val': X_val_scaled}, status_callback)
+
+    joblib.dump(scaler, scaler_filename)
+    save_checkpoint(model_filename, model, {**config, 'sample_counts': sample_counts, 'recordings': fingerprints,
+                                            'gate': gate.to_dict() if gate else None})
+    status_callback(f"Incremental update complete. Model saved: {model_filename}")
     return True
 
 # This block allows the script to be run directly for testing purposes.
 if __name__ == "__main__":
-    print("Running in standalone training mode for patient: 'test'")
-    train_model(patient_id="test")
+    import argparse
+    parser = argparse.ArgumentParser(description="Train activity models.")
+    parser.add_argument('--patient', default='test', help="Patient ID to train")
+    parser.add_argument('--base', action='store_true', help="Pretrain the population base model on all recordings")
+    parser.add_argument('--finetune', action='store_true', help="Fine-tune the base model instead of training from scratch")
+    parser.add_argument('--unfreeze', action='store_true', help="Fine-tune the conv layers too, at a reduced learning rate")
+    parser.add_argument('--compare', action='store_true', help="Also train from scratch and report both")
+    parser.add_argument('--features', nargs='+', default=None, help="Feature extractors for a new model (see features.py)")
+    parser.add_argument('--update', action='store_true', help="Continue training the existing model on newly recorded data")
+    args = parser.parse_args()
+
+    if args.base:
+        pretrain_base_model(config={'features': args.features} if args.features else None)
+    elif args.update:
+        update_model(args.patient)
+    elif args.finetune:
+        fine_tune_model(args.patient, freeze_conv=not args.unfreeze, compare=args.compare)
+    else:
+        print(f"Running in standalone training mode for patient: '{args.patient}'")
+        train_model(patient_id=args.patient, config={'features': args.features} if args.features else None)
@@ -151,8 +151,8 @@ function App() {
   };
 
   /** Starts a data recording session for a given patient and activity. */
-  const handleStartRecording = (pid: string, act: string) => {
-    socketService.startRecording(pid, act);
+  const handleStartRecording = (pid: string, act: string, append: boolean) => {
+    socketService.startRecording(pid, act, append);
   };
 
   /** Stops the current data recording session. */
@@ -4,7 +4,7 @@ interface DataRecorderProps {
   recording: boolean;
   currentActivity: string;
   patientId: string;
-  onStartRecording: (patientId: string, activity: string) => void;
+  onStartRecording: (patientId: string, activity: string, append: boolean) => void;
   onStopRecording: () => void;
   onPatientIdChange: (patientId: string) => void;
   liveDataCount: number;
@@ -22,10 +22,11 @@ export function DataRecorder({
   liveDataCount,
 }: DataRecorderProps) {
   const [selectedActivity, setSelectedActivity] = useState('still');
+  const [append, setAppend] = useState(false);
 
   const handleStartRecording = () => {
     if (!recording && patientId && selectedActivity) {
-      onStartRecording(patientId, selectedActivity);
+      onStartRecording(patientId, selectedActivity, append);
     }
   };
 
@@ -63,6 +64,19 @@ export function DataRecorder({
           </select>
         </div>
 
+        <div className="form-group">
+          <label htmlFor="append-recording">
+            <input
+              id="append-recording"
+              type="checkbox"
+              checked={append}
+              onChange={(e) => setAppend(e.target.checked)}
+              disabled={recording}
+            />
+            {' '}Add to the existing recording (instead of replacing it)
+          </label>
+        </div>
+
         <div className="recording-actions">
           {!recording ? (
             <button
@@ -104,6 +118,7 @@ export function DataRecorder({
           <li>Click "Stop Recording" when done</li>
           <li>Repeat for both activities (still, active)</li>
           <li>Once both activities are recorded, train the model</li>
+          <li>To improve an existing model, tick "Add to the existing recording" and record more; training then updates the model with just the new data</li>
         </ol>
       </div>
     </div>
@@ -8,6 +8,7 @@ import type {
   StatusUpdate,
   MaxSecondsUpdate,
   LiveDataEvent,
+  LinkStatus,
   DeviceState,
 } from '../types';
 
@@ -22,6 +23,7 @@ export interface SocketServiceCallbacks {
   onStatusUpdate?: (data: StatusUpdate) => void;
   onMaxSecondsUpdate?: (data: MaxSecondsUpdate) => void;
   onLiveData?: (data: LiveDataEvent) => void;
+  onLinkStatus?: (data: LinkStatus) => void;
   onConnect?: () => void;
   onDisconnect?: () => void;
 }
@@ -29,6 +31,10 @@ export interface SocketServiceCallbacks {
 class SocketService {
   private socket: Socket | null = null;
   private callbacks: SocketServiceCallbacks = {};
+  // Last merged payloads. The backend sends state and activity updates as deltas
+  // against what this client last received, with periodic full snapshots.
+  private lastState: Partial<StateUpdate> = {};
+  private lastActivity: Partial<ActivityUpdate> = {};
 
   connect(callbacks: SocketServiceCallbacks) {
     this.callbacks = callbacks;
@@ -43,6 +49,10 @@ class SocketService {
     // Connection events
     this.socket.on('connect', () => {
       console.log('[SocketService] Connected to backend');
+      this.lastState = {};
+      this.lastActivity = {};
+      // Follow whichever patient the device is monitoring; the backend replies with a snapshot.
+      this.socket?.emit('subscribe', {});
       this.callbacks.onConnect?.();
     });
 
@@ -52,12 +62,14 @@ class SocketService {
     });
 
     // Data events
-    this.socket.on('state_update', (data: StateUpdate) => {
-      this.callbacks.onStateUpdate?.(data);
+    this.socket.on('state_update', (data: Partial<StateUpdate>) => {
+      this.lastState = data.full ? { ...data } : { ...this.lastState, ...data };
+      this.callbacks.onStateUpdate?.(this.lastState as StateUpdate);
     });
 
-    this.socket.on('activity_update', (data: ActivityUpdate) => {
-      this.callbacks.onActivityUpdate?.(data);
+    this.socket.on('activity_update', (data: Partial<ActivityUpdate>) => {
+      this.lastActivity = data.full ? { ...data } : { ...this.lastActivity, ...data };
+      this.callbacks.onActivityUpdate?.(this.lastActivity as ActivityUpdate);
     });
 
     this.socket.on('sleep_data_update', (data: SleepDataUpdate) => {
@@ -83,6 +95,10 @@ class SocketService {
     this.socket.on('live_data', (data: LiveDataEvent) => {
       this.callbacks.onLiveData?.(data);
     });
+
+    this.socket.on('link_status', (data: LinkStatus) => {
+      this.callbacks.onLinkStatus?.(data);
+    });
   }
 
   disconnect() {
@@ -93,6 +109,18 @@ class SocketService {
   }
 
   // Client-to-server event emitters
+  subscribe(patientIds?: string[]) {
+    this.socket?.emit('subscribe', patientIds ? { patients: patientIds } : {});
+  }
+
+  unsubscribe(patientIds?: string[]) {
+    this.socket?.emit('unsubscribe', patientIds ? { patients: patientIds } : {});
+  }
+
+  requestSnapshot(patientId?: string) {
+    this.socket?.emit('request_snapshot', patientId ? { patient_id: patientId } : {});
+  }
+
   setState(state: DeviceState) {
     this.socket?.emit('set_state', { state });
   }
@@ -101,16 +129,19 @@ class SocketService {
     this.socket?.emit('set_max_seconds', { maxSeconds });
   }
 
-  startRecording(patientId: string, activity: string) {
-    this.socket?.emit('start_recording', { patient_id: patientId, activity });
+  // With append, the session is added to the activity's existing recording instead of replacing it.
+  startRecording(patientId: string, activity: string, append = false) {
+    this.socket?.emit('start_recording', { patient_id: patientId, activity, append });
   }
 
   stopRecording() {
     this.socket?.emit('stop_recording');
   }
 
-  trainModel(patientId: string) {
-    this.socket?.emit('train_model', { patient_id: patientId });
+  // mode: 'scratch', 'finetune' (from the population base model), 'incremental' (continue the existing
+  // model on newly recorded data) or 'auto' (let the backend pick).
+  trainModel(patientId: string, mode: 'auto' | 'scratch' | 'finetune' | 'incremental' = 'auto') {
+    this.socket?.emit('train_model', { patient_id: patientId, mode });
   }
 
   isConnected(): boolean {
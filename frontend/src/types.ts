@@ -17,6 +17,7 @@ export interface StateUpdate {
   activity?: string;
   patient: string;
   maxSeconds: number;
+  full?: boolean; // True for a full snapshot, false for a delta
 }
 
 // Activity update event from backend
@@ -24,12 +25,15 @@ export interface ActivityUpdate {
   activity: Activity;
   seconds: number;
   warning?: string;
+  full?: boolean; // True for a full snapshot, false for a delta
+  sample?: number; // Packet sequence number (simulated device only)
 }
 
 // Sleep data update event from backend
 export interface SleepDataUpdate {
   temp: SensorStats;
   sleepDuration: number;
+  sample?: number; // Packet sequence number (simulated device only)
 }
 
 // Recording status event from backend
@@ -57,3 +61,13 @@ export interface MaxSecondsUpdate {
 export interface LiveDataEvent {
   data: string;
 }
+
+// Serial link status event from backend
+export interface LinkStatus {
+  connected: boolean;
+  port: string | null;
+  startupConnectMs: number | null; // Time to find the device when the backend started
+  lastRecoveryMs: number | null; // Time from disconnect to handshake on the last reconnect
+  avgRecoveryMs: number | null;
+  reconnects: number;
+}